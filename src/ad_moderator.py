@@ -1,34 +1,469 @@
 import os
 import json
+import logging
 import shutil
+import threading
 import time
 import argparse
-from urllib.parse import urlparse
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 
-from .text_moderator.text_moderator import moderate_text
-from .image_moderator.image_moderator import moderate_images
+from .text_moderator.text_moderator import moderate_texts, text_moderation_identity
+from .image_moderator.image_moderator import (
+    configure_detector,
+    detector_identity,
+    moderate_image_buffers,
+    warmup_model,
+)
 
 from .config import load_config
 from .logging_setup import setup_logging
 from .db import (
-    init_db,
     get_conn,
-    fetch_paid_ads,
-    group_ads,
-    save_run,
-    save_detections,
-    save_result_summary,
-    commit_ad_moderated,
-    commit_ad_rejected,
-    replace_advertisement_images,
+    fetch_previous_runs,
+    iter_claimed_ads,
+    save_ad_result,
+    save_ad_results,
+    save_ad_results_bulk,
+    oldest_paid_age_seconds,
+    release_claims,
+    install_paid_notify_trigger,
+    PaidAdsListener,
 )
-from .storage import _make_client, ensure_bucket, upload_file, build_object_url
-from .utils import download_files
+from .storage import upload_objects, build_object_url
+from .runtime import Runtime
+from .utils import download_buffers, configure_downloads
+from .pipeline import Stage, run_pipeline
+from .fingerprint import content_fingerprint, text_fingerprint
+from .metrics import ADS_PER_SECOND, ADS_PROCESSED, DB_SECONDS, OLDEST_PAID_AGE, multiprocess_enabled, start_http_server
+
+# Фоновый поток для пакетной текстовой модерации
+_text_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="text-batch")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AdJob:
+    """Состояние одного объявления по мере прохождения стадий конвейера."""
+
+    ad_id: str
+    description: str
+    image_urls: List[str]
+    verdict: dict = field(default_factory=lambda: {"acceptable": True, "detections": []})
+    tmp_dir: str = ""
+    image_items: list = field(default_factory=list)
+    covered: Dict[str, bytes] = field(default_factory=dict)
+    new_urls: List[str] = field(default_factory=list)
+    # Результат пакетной текстовой модерации всей выборки и индекс этого объявления в ней
+    text_future: Optional[Future] = None
+    text_index: int = 0
+    # Все ссылки объявления; image_urls — только те, что нужно скачать и проверить
+    all_urls: List[str] = field(default_factory=list)
+    text_fingerprint: str = ""
+    # Повторная модерация: часть результата взята из предыдущего запуска (см. _plan_reuse)
+    incremental: bool = False
+    text_reused: bool = False
+    # Ссылки, которые не удалось скачать или проверить: с ними отпечаток содержимого не сохраняется
+    unchecked_urls: List[str] = field(default_factory=list)
+    # Время стадий конвейера по этому объявлению, секунды
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class _BatchContext:
+    """Общие для всех стадий объекты одного запуска run_once."""
+
+    def __init__(self, cfg, conn, runtime: Runtime):
+        self.cfg = cfg
+        self.conn = conn
+        self.runtime = runtime
+        # Результаты, ожидающие записи в БД одним коммитом
+        self.pending: List[AdJob] = []
+        # Время поступления первого результата в pending
+        self.pending_since = 0.0
+        # Сколько объявлений захвачено под аренду в этом запуске (включая отброшенные стадиями)
+        self.claimed = 0
+        # Захваченные объявления, результат которых ещё не записан (для release_outstanding)
+        self.outstanding = set()
+        # Запись идёт из потока persist и из таймера сброса через одно соединение
+        self._lock = threading.RLock()
+        self._timer: Optional[threading.Thread] = None
+        self._timer_stop = threading.Event()
+        # Будит таймер, когда в пустой pending приходит первый результат
+        self._pending_added = threading.Event()
+
+    @property
+    def max_delay(self) -> float:
+        return float(getattr(self.cfg, "persist_flush_seconds", 0) or 0)
+
+    def persist(self, job: AdJob) -> None:
+        with self._lock:
+            if not self.pending:
+                self.pending_since = time.monotonic()
+                self._pending_added.set()
+            self.pending.append(job)
+            # Сбрасываем по размеру пачки; по возрасту самого старого результата — таймер
+            if len(self.pending) >= max(1, int(self.cfg.persist_batch_size or 1)):
+                self.flush()
+
+    def start_flush_timer(self) -> None:
+        """Фоновый сброс результатов старше PERSIST_FLUSH_SECONDS, даже если новых результатов нет."""
+        if self.max_delay <= 0 or self._timer is not None:
+            return
+        self._timer_stop.clear()
+        self._timer = threading.Thread(target=self._flush_loop, name="persist-flush", daemon=True)
+        self._timer.start()
+
+    def stop_flush_timer(self) -> None:
+        if self._timer is None:
+            return
+        self._timer_stop.set()
+        self._pending_added.set()
+        self._timer.join()
+        self._timer = None
+
+    def _flush_loop(self) -> None:
+        max_delay = self.max_delay
+        while not self._timer_stop.is_set():
+            with self._lock:
+                wait = None
+                if self.pending:
+                    age = time.monotonic() - self.pending_since
+                    if age >= max_delay:
+                        self.flush()
+                    else:
+                        wait = max_delay - age
+                if wait is None:
+                    # Пусто: ждём первый результат, от него отсчитываем max_delay
+                    self._pending_added.clear()
+            if wait is None:
+                self._pending_added.wait()
+            else:
+                self._timer_stop.wait(wait)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        jobs, self.pending = self.pending, []
+        if not jobs:
+            return
+        items = [(j.ad_id, j.verdict, j.new_urls, _target_status(self.cfg, j)) for j in jobs]
+        try:
+            # Пачку пишем через COPY, одно объявление — одним запросом save_ad_result
+            if len(items) > 1:
+                with DB_SECONDS.labels(op="save_bulk").time():
+                    results = save_ad_results_bulk(self.conn, items, worker_id=self.cfg.worker_id)
+            else:
+                with DB_SECONDS.labels(op="save").time():
+                    results = save_ad_results(self.conn, items, worker_id=self.cfg.worker_id)
+        except Exception as e:
+            if len(jobs) == 1:
+                print(f"[DB][ERROR] Failed to save results for ad {jobs[0].ad_id}: {e}")
+                return
+            # Одно проблемное объявление не должно терять результаты всей группы
+            print(f"[DB][ERROR] Group save failed ({len(jobs)} ads), retrying one by one: {e}")
+            results = []
+            for item in items:
+                try:
+                    with DB_SECONDS.labels(op="save_one").time():
+                        results.append(save_ad_result(self.conn, *item, worker_id=self.cfg.worker_id))
+                except Exception as e1:
+                    self.conn.rollback()
+                    print(f"[DB][ERROR] Failed to save results for ad {item[0]}: {e1}")
+                    results.append(None)
+
+        for (ad_id, _, _, status_str), res in zip(items, results):
+            if res is not None:
+                self.outstanding.discard(ad_id)
+            if res is None or status_str is None:
+                continue
+            _, updated = res
+            if updated:
+                print(f"[COMMIT] Ad {ad_id}: status -> {status_str} (rows updated: {updated})")
+            else:
+                print(f"[COMMIT] Ad {ad_id}: no rows updated (possibly not in PAID)")
+
+    def release_outstanding(self) -> None:
+        """Снимает аренду с захваченных, но не записанных объявлений (остановка или сбой запуска).
+
+        Объявления, отброшенные стадией при нормальной работе, сюда не попадают:
+        их аренда истекает сама и служит паузой перед повторной попыткой.
+        """
+        ids, self.outstanding = list(self.outstanding), set()
+        if not ids:
+            return
+        try:
+            released = release_claims(self.conn, ids, self.cfg.worker_id)
+            print(f"[CLAIM] Released {released} unfinished ad(s)")
+        except Exception as e:
+            self.conn.rollback()
+            print(f"[CLAIM][ERROR] Failed to release {len(ids)} claim(s): {e}")
+
+
+def _target_status(cfg, job: AdJob):
+    # По флагу COMMIT_RESULTS: если есть нарушения в тексте — REJECTED, иначе MODERATED
+    if not getattr(cfg, "commit_results", False):
+        return None
+    has_text_violations = any(d.get("type") == "text" for d in job.verdict["detections"])
+    return "REJECTED" if has_text_violations else "MODERATED"
+
+
+def _fingerprint_salt(cfg) -> str:
+    # Смена версии правил, модели детектора (файла или параметров) или настроек
+    # текстовой модели и порогов делает старые вердикты непригодными
+    return (
+        f"{getattr(cfg, 'moderation_version', '')}|{detector_identity(cfg.model_path)}"
+        f"|{text_moderation_identity()}"
+    )
+
+
+def _covered_key(cfg, url: str) -> Optional[str]:
+    """Ключ объекта, если url — уже покрытое нами изображение в клиентском бакете."""
+    marker = f"/{cfg.minio.client_bucket}/images/covered/"
+    idx = url.find(marker)
+    if idx < 0:
+        return None
+    return url[idx + len(cfg.minio.client_bucket) + 2:]
+
+
+def _plan_reuse(cfg, job: AdJob, previous) -> None:
+    """Переиспользует результат предыдущего запуска объявления, если содержимое не менялось.
+
+    previous — (run_id, content_fingerprint, text_fingerprint, verdict) из
+    fetch_previous_runs или None. Полное совпадение отпечатка — вердикт берётся
+    целиком; совпадение описания — берутся текстовые детекции; уже покрытые
+    нами изображения (images/covered/) не скачиваются и не проверяются повторно.
+    """
+    salt = _fingerprint_salt(cfg)
+    job.all_urls = list(job.image_urls)
+    job.text_fingerprint = text_fingerprint(job.description, salt)
+    if previous is None:
+        return
+    run_id, prev_content_fp, prev_text_fp, prev_verdict = previous
+    prev_dets = list(prev_verdict.get("detections") or [])
+
+    if prev_content_fp and prev_content_fp == content_fingerprint(job.description, job.all_urls, salt):
+        job.verdict["detections"] = prev_dets
+        job.verdict["reused_run"] = run_id
+        job.image_urls = []
+        job.incremental = True
+        job.text_reused = True
+        return
+
+    if prev_text_fp and prev_text_fp == job.text_fingerprint:
+        job.verdict["detections"].extend(d for d in prev_dets if d.get("type") == "text")
+        job.text_reused = True
+
+    by_key: Dict[str, list] = {}
+    for det in prev_dets:
+        if det.get("type") == "image" and det.get("object_key"):
+            by_key.setdefault(det["object_key"], []).append(det)
+    fresh = []
+    for url in job.all_urls:
+        key = _covered_key(cfg, url)
+        if key is None:
+            fresh.append(url)
+            continue
+        job.verdict["detections"].extend(by_key.get(key, []))
+        job.incremental = True
+    job.image_urls = fresh
+
+
+def _timed_stage(name: str, func, ctx: _BatchContext, job: AdJob) -> AdJob:
+    # Гистограммы стадий пишет run_pipeline; здесь — время для сводки по объявлению
+    started = time.perf_counter()
+    try:
+        return func(ctx, job)
+    finally:
+        job.timings[name] = round(time.perf_counter() - started, 4)
+
+
+def _download_stage(ctx: _BatchContext, job: AdJob) -> AdJob:
+    # Скачиваем изображения в память; на диск (tmp_dir) — только при превышении лимита
+    job.tmp_dir = os.path.join(ctx.cfg.output_folder, "tmp", job.ad_id)
+    job.image_items = download_buffers(
+        job.image_urls,
+        spill_dir=job.tmp_dir,
+        memory_limit_bytes=ctx.cfg.image_memory_limit_bytes,
+    )
+    # download_buffers пропускает нескачанные файлы молча
+    downloaded = {url for url, _ in job.image_items}
+    job.unchecked_urls.extend(u for u in job.image_urls if u not in downloaded)
+    return job
+
+
+def _text_stage(ctx: _BatchContext, job: AdJob) -> AdJob:
+    # Текстовая модерация считается одной пачкой на всю выборку (см. run_once);
+    # к этому моменту она обычно уже готова, пока шло скачивание изображений
+    if job.text_future is not None:
+        job.verdict["detections"].extend(job.text_future.result()[job.text_index])
+    return job
+
+
+def _image_stage(ctx: _BatchContext, job: AdJob) -> AdJob:
+    # Запускаем модерацию изображений
+    if job.image_items:
+        img_dets, job.covered = moderate_image_buffers(
+            job.image_items,
+            model_path=ctx.cfg.model_path,
+            batch_size=ctx.cfg.detect_batch_size,
+            cache=ctx.runtime.image_cache,
+            pool=ctx.runtime.image_pool,
+            skipped=job.unchecked_urls,
+        )
+        # Проставляем object_key детекциям новых покрытых изображений
+        # (у попаданий в кэш он уже указывает на ранее загруженный объект)
+        for det in img_dets:
+            if det.get("output_name"):
+                det["object_key"] = f"images/covered/{job.ad_id}/{det['output_name']}"
+        job.verdict["detections"].extend(img_dets)
+    # Буферы исходных изображений дальше не нужны
+    job.image_items = []
+    return job
+
+
+def _upload_stage(ctx: _BatchContext, job: AdJob) -> AdJob:
+    cfg = ctx.cfg
+    # Загружаем покрытые изображения в MinIO параллельно прямо из памяти
+    items = [
+        (payload, f"images/covered/{job.ad_id}/{output_name}")
+        for output_name, payload in job.covered.items()
+    ]
+    results = upload_objects(
+        ctx.runtime.minio,
+        cfg.minio.client_bucket,
+        items,
+        max_workers=cfg.upload_concurrency,
+        retries=cfg.upload_retries,
+    )
+    job.covered = {}
+    failed = [r for r in results if not r.ok]
+    if failed:
+        # Следующая загрузка пойдёт через новый клиент; объявление останется PAID
+        ctx.runtime.reset_minio()
+        raise RuntimeError(
+            f"Failed to upload {len(failed)} covered image(s) for ad {job.ad_id}: "
+            + "; ".join(f"{r.object_name}: {r.error}" for r in failed)
+        )
+
+    image_dets = [d for d in job.verdict["detections"] if d.get("type") == "image"]
+    # Загруженные объекты теперь можно переиспользовать для того же содержимого
+    cache = ctx.runtime.image_cache
+    if cache is not None:
+        for det in image_dets:
+            if det.get("output_name") and det.get("content_hash"):
+                cache.set_object_key(det["content_hash"], det["object_key"])
+
+    # Каждое проверенное изображение с номерами заменяется покрытой версией
+    # (загруженной сейчас или взятой из кэша) на своём месте; фото без номеров
+    # и уже покрытые в прошлых запусках остаются как есть
+    checked = set(job.image_urls)
+    replaced = {
+        d["image"]: _object_url(cfg, d["object_key"])
+        for d in image_dets
+        if d.get("object_key") and d.get("image") in checked
+    }
+    if replaced:
+        job.new_urls = [replaced.get(u, u) for u in job.all_urls or job.image_urls]
+    return job
+
+
+def _object_url(cfg, key: str) -> str:
+    if cfg.minio.client_public_access:
+        return build_object_url(cfg.minio, cfg.minio.client_bucket, key)
+    # Для приватных бакетов сохраняем canonical s3-ссылку
+    return f"s3://{cfg.minio.client_bucket}/{key}"
+
+
+def _persist_stage(ctx: _BatchContext, job: AdJob) -> AdJob:
+    cfg = ctx.cfg
+    verdict = job.verdict
+
+    # Отпечаток состояния после модерации (с заменёнными ссылками): следующий
+    # запуск по тому же объявлению без изменений совпадёт с ним и возьмёт вердикт.
+    # Если часть изображений не скачалась или не проверилась, отпечаток не пишем:
+    # иначе повторная подача без изменений так и не проверит эти изображения
+    verdict["text_fingerprint"] = job.text_fingerprint
+    verdict["content_fingerprint"] = None
+    if job.unchecked_urls:
+        print(f"[REUSE] Ad {job.ad_id}: {len(job.unchecked_urls)} image(s) not checked, verdict will not be reused")
+    else:
+        verdict["content_fingerprint"] = content_fingerprint(
+            job.description, job.new_urls or job.all_urls, _fingerprint_salt(cfg)
+        )
+
+    # Итог
+    if verdict["detections"]:
+        verdict["acceptable"] = False
+
+    # Прогон, детекции, сводка, замена изображений и статус — одной транзакцией
+    ctx.persist(job)
+    logger.info(
+        "[AD][DONE] ad=%s detections=%d",
+        job.ad_id,
+        len(verdict["detections"]),
+        extra={
+            "ad_id": job.ad_id,
+            "detections": len(verdict["detections"]),
+            "images": len(job.image_urls),
+            "reused": bool(verdict.get("reused_run")),
+            "timings": dict(job.timings),
+        },
+    )
+
+    # Очистка файлов, сброшенных на диск при нехватке памяти
+    try:
+        shutil.rmtree(job.tmp_dir, ignore_errors=True)
+    except Exception:
+        pass
+
+    # Локальный вывод результата для отладки
+    out_json = os.path.join(cfg.output_folder, f"verdict_{job.ad_id}.json")
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(verdict, f, ensure_ascii=False, indent=2)
+    return job
+
+
+def _configure_detector(cfg) -> None:
+    d = cfg.detector
+    configure_detector(
+        backend=d.backend,
+        conf=d.conf,
+        iou=d.iou,
+        intra_op_threads=d.intra_op_threads,
+        inter_op_threads=d.inter_op_threads,
+        quantize=d.quantize,
+        imgsz=d.imgsz,
+        calibration_dir=d.calibration_dir,
+        decode_reduction=d.decode_reduction,
+    )
+
 
 # Параметры путей берутся из конфигурации (см. config.py)
-def run_once(cfg):
+def run_once(cfg, runtime: Optional[Runtime] = None) -> int:
+    """Один проход модерации: выборка пачки PAID-объявлений и их обработка конвейером.
+
+    Стадии (скачивание, текст, изображения, загрузка в MinIO, запись в БД)
+    работают параллельно над разными объявлениями. Соединения и клиенты
+    берутся из runtime; без него создаётся временный контекст на один проход.
+    Возвращает число обработанных объявлений.
+    """
+    if runtime is None:
+        runtime = Runtime(cfg)
+        try:
+            return run_once(cfg, runtime)
+        finally:
+            runtime.close()
+    return _run_batch(cfg, runtime)[1]
+
+
+def _run_batch(cfg, runtime: Runtime) -> Tuple[int, int]:
+    """Тело run_once; возвращает (захвачено объявлений, обработано объявлений)."""
     output_folder = cfg.output_folder
-    model_path = cfg.model_path
     os.makedirs(output_folder, exist_ok=True)
     # По флагу из .env очищаем выходную папку перед запуском
     if getattr(cfg, "clean_output_on_start", False):
@@ -38,117 +473,125 @@ def run_once(cfg):
             pass
         os.makedirs(output_folder, exist_ok=True)
 
-    # Инициализация БД и MinIO
-    init_db(cfg.db)
-    minio_client = _make_client(cfg.minio)
-    ensure_bucket(minio_client, cfg.minio.system_bucket, public=False)
-    ensure_bucket(minio_client, cfg.minio.client_bucket, public=cfg.minio.client_public_access)
-
-    with get_conn(cfg.db) as conn:
-        rows = fetch_paid_ads(conn, limit=cfg.batch_limit)
-        ads = group_ads(rows)
-
-        for ad_id, data in ads.items():
-            description = data.get("description") or ""
-            image_urls = data.get("image_urls") or []
-
-            verdict = {"acceptable": True, "detections": []}
-
-            # Текстовая модерация
-            if description:
-                verdict["detections"].extend(moderate_text(description))
-
-            # Скачиваем изображения во временную папку
-            tmp_dir = os.path.join(output_folder, "tmp", ad_id)
-            local_paths = download_files(image_urls, tmp_dir)
-
-            # Запускаем модерацию изображений
-            if local_paths:
-                covered_dir = os.path.join(output_folder, "images")
-                img_dets = moderate_images(
-                    image_paths=local_paths,
-                    model_path=model_path,
-                    output_dir=covered_dir,
-                    ad_id=ad_id,
-                )
-                verdict["detections"].extend(img_dets)
-
-                # Загружаем покрытые изображения в MinIO и собираем новые ссылки
-                uploaded_object_keys = []
-                seen_paths = set()
-                for det in img_dets:
-                    out_path = det.get("output_path")
-                    if not out_path:
-                        continue
-                    # Загружаем файл ровно один раз на уникальный out_path
-                    if out_path not in seen_paths:
-                        seen_paths.add(out_path)
-                        filename = os.path.basename(out_path)
-                        object_name = f"images/covered/{ad_id}/{filename}"
-                        upload_file(minio_client, cfg.minio.client_bucket, out_path, object_name)
-                        uploaded_object_keys.append(object_name)
-                    else:
-                        # Вычисляем object_name по существующему пути
-                        filename = os.path.basename(out_path)
-                        object_name = f"images/covered/{ad_id}/{filename}"
-                    # Проставляем object_key всем детекциям
-                    det["object_key"] = object_name
-
-                # Формируем публичные или s3-ссылки и заменяем их в advertisement_images
-                if uploaded_object_keys:
-                    if cfg.minio.client_public_access:
-                        new_urls = [
-                            build_object_url(cfg.minio, cfg.minio.client_bucket, key)
-                            for key in uploaded_object_keys
-                        ]
-                    else:
-                        # Для приватных бакетов сохраняем canonical s3-ссылку
-                        new_urls = [f"s3://{cfg.minio.client_bucket}/{key}" for key in uploaded_object_keys]
-
-                    try:
-                        replace_advertisement_images(conn, ad_id, new_urls)
-                    except Exception as e:
-                        print(f"[DB][ERROR] Failed to replace images for ad {ad_id}: {e}")
+    # Лимиты общего пула загрузок (сессия и соединения живут весь процесс)
+    configure_downloads(cfg.download_concurrency, cfg.download_per_host_limit)
+    _configure_detector(cfg)
 
-            # Итог и сохранение в наши таблицы
-            if verdict["detections"]:
-                verdict["acceptable"] = False
+    # Схема БД и бакеты готовятся один раз на процесс
+    runtime.ensure_ready()
+    # Секции на будущие периоды и удаление данных старше DB_RETENTION_DAYS — в фоне, не чаще раза в час
+    runtime.maintain()
+    # Процессы пула изображений запускаем до рабочих потоков конвейера
+    image_pool = runtime.image_pool
 
-            run_id = save_run(conn, verdict["acceptable"], ad_id, verdict)
-            save_detections(conn, run_id, verdict["detections"])
-            # Сводная запись по результатам модерации (отдельная таблица)
-            save_result_summary(conn, run_id, ad_id, verdict["detections"]) 
+    with runtime.connection() as conn:
+        ctx = _BatchContext(cfg, conn, runtime)
 
-            # По флагу COMMIT_RESULTS: если есть нарушения в тексте — REJECTED, иначе MODERATED
-            if getattr(cfg, "commit_results", False):
-                try:
-                    has_text_violations = any(d.get("type") == "text" for d in verdict["detections"])
-                    if has_text_violations:
-                        updated = commit_ad_rejected(conn, ad_id)
-                        status_str = "REJECTED"
-                    else:
-                        updated = commit_ad_moderated(conn, ad_id)
-                        status_str = "MODERATED"
-
-                    if updated:
-                        print(f"[COMMIT] Ad {ad_id}: status -> {status_str} (rows updated: {updated})")
-                    else:
-                        print(f"[COMMIT] Ad {ad_id}: no rows updated (possibly not in PAID)")
-                except Exception as e:
-                    print(f"[COMMIT][ERROR] Failed to update ad {ad_id}: {e}")
+        def _fetch():
+            # Очередь PAID читается страницами под аренду (параллельные воркеры не берут те же объявления).
+            # Следующая страница захватывается, когда конвейер готов принять объявления,
+            # поэтому обработка начинается с первой страницы, а не после всей выборки.
+            # Отдельное соединение: основное в это время занято записью результатов
+            with runtime.connection() as fetch_conn:
+                pages = iter_claimed_ads(
+                    fetch_conn,
+                    worker_id=cfg.worker_id,
+                    lease_seconds=cfg.claim_lease_seconds,
+                    limit=cfg.batch_limit,
+                    page_size=cfg.fetch_page_size,
+                )
+                while True:
+                    with DB_SECONDS.labels(op="claim_page").time():
+                        page = next(pages, None)
+                    if page is None:
+                        break
+                    ctx.claimed += len(page)
+                    ctx.outstanding.update(ad_id for ad_id, _, _ in page)
+                    jobs = [
+                        AdJob(ad_id=ad_id, description=description, image_urls=image_urls)
+                        for ad_id, description, image_urls in page
+                    ]
+                    previous = {}
+                    if cfg.reuse_verdicts:
+                        try:
+                            with DB_SECONDS.labels(op="previous_runs").time():
+                                previous = fetch_previous_runs(fetch_conn, [j.ad_id for j in jobs])
+                        except Exception as e:
+                            fetch_conn.rollback()
+                            print(f"[REUSE][ERROR] Failed to load previous runs: {e}")
+                    for job in jobs:
+                        _plan_reuse(cfg, job, previous.get(job.ad_id))
+                    # Тексты страницы — одним пакетным вызовом модели в фоне,
+                    # параллельно со скачиванием изображений
+                    to_check = [j for j in jobs if not j.text_reused]
+                    text_future = None
+                    if to_check:
+                        text_future = _text_executor.submit(
+                            moderate_texts, [j.description for j in to_check], cfg.text_batch_size
+                        )
+                    for idx, job in enumerate(to_check):
+                        job.text_future = text_future
+                        job.text_index = idx
+                    for job in jobs:
+                        if job.verdict.get("reused_run"):
+                            print(f"[REUSE] Ad {job.ad_id}: content unchanged since run {job.verdict['reused_run']}")
+                        yield job
 
-            # Очистка временных файлов
+        workers = cfg.pipeline
+        stages = [
+            Stage("download", partial(_timed_stage, "download", _download_stage, ctx), workers.download_workers),
+            Stage("text", partial(_timed_stage, "text", _text_stage, ctx), workers.text_workers),
+            # В режиме процессов каждый поток стадии ждёт свой процесс пула
+            Stage(
+                "image",
+                partial(_timed_stage, "image", _image_stage, ctx),
+                max(workers.image_workers, image_pool.workers if image_pool else 0),
+            ),
+            Stage("upload", partial(_timed_stage, "upload", _upload_stage, ctx), workers.upload_workers),
+            # Запись в БД идёт через одно соединение, поэтому поток один
+            Stage("persist", partial(_persist_stage, ctx), 1),
+        ]
+        started = time.monotonic()
+        ctx.start_flush_timer()
+        try:
+            processed = run_pipeline(_fetch(), stages, queue_size=workers.queue_size)
+            ctx.stop_flush_timer()
+            # Время записи учитывается внутри flush (op="save"/"save_bulk")
+            ctx.flush()
+        except BaseException:
+            # Остановка (Ctrl+C) или сбой выборки: готовое сохраняем, остальное
+            # отпускаем сразу, а не через claim_lease_seconds
+            ctx.stop_flush_timer()
             try:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-            except Exception:
-                pass
+                ctx.flush()
+            finally:
+                ctx.release_outstanding()
+            raise
+        elapsed = time.monotonic() - started
 
-            # Локальный вывод результата для отладки
-            out_json = os.path.join(output_folder, f"verdict_{ad_id}.json")
-            with open(out_json, "w", encoding="utf-8") as f:
-                json.dump(verdict, f, ensure_ascii=False, indent=2)
+        ADS_PROCESSED.inc(processed)
+        ADS_PER_SECOND.set(processed / elapsed if elapsed > 0 else 0.0)
+        oldest = None
+        try:
+            oldest = oldest_paid_age_seconds(conn)
+            OLDEST_PAID_AGE.set(oldest)
+        except Exception as e:
+            conn.rollback()
+            print(f"[METRICS][ERROR] Failed to read PAID queue age: {e}")
 
-    print("=== BATCH MODERATION DONE ===")
+    logger.info(
+        "[BATCH][DONE] ads=%d elapsed=%.2fs",
+        processed,
+        elapsed,
+        extra={
+            "ads": processed,
+            "elapsed": round(elapsed, 3),
+            "ads_per_second": round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+            "oldest_paid_age": oldest,
+        },
+    )
+    print(f"=== BATCH MODERATION DONE === ads={processed}")
+    return ctx.claimed, processed
 
 
 def main():
@@ -161,6 +604,13 @@ def main():
         default=None,  # None позволит отличить "не задано" от 0 в .env
         help="Периодичность запуска в минутах. 0 — однократный запуск.",
     )
+    parser.add_argument(
+        "--drain",
+        dest="drain",
+        action="store_true",
+        default=None,
+        help="Разбирать очередь PAID пачками подряд, пока она не опустеет.",
+    )
     args = parser.parse_args()
 
     cfg = load_config()
@@ -171,6 +621,28 @@ def main():
         # В крайнем случае не падаем из‑за логгера
         pass
 
+    # Эндпоинт /metrics для Prometheus живёт весь процесс
+    if getattr(cfg, "metrics_port", 0):
+        try:
+            start_http_server(cfg.metrics_port, cfg.metrics_host)
+            print(f"[METRICS] http://{cfg.metrics_host}:{cfg.metrics_port}/metrics")
+            if cfg.pipeline.image_processes > 0 and not multiprocess_enabled():
+                print("[METRICS] PROMETHEUS_MULTIPROC_DIR не задан: метрик процессов пула изображений не будет")
+        except Exception as e:
+            print(f"[METRICS][ERROR] Не удалось запустить эндпоинт метрик: {e}")
+
+    # Загружаем модель и прогреваем её один раз на процесс,
+    # чтобы первое объявление не платило за загрузку и первый инференс.
+    # В режиме пула процессов модель грузит каждый процесс пула, а не основной
+    process_mode = cfg.pipeline.image_processes > 0
+    try:
+        _configure_detector(cfg)
+        if not process_mode:
+            warmup_model(cfg.model_path)
+            print(f"[MODEL] Модель загружена и прогрета: {cfg.model_path} (backend={cfg.detector.backend})")
+    except Exception as e:
+        print(f"[MODEL][ERROR] Не удалось прогреть модель {cfg.model_path}: {e}")
+
     # Приоритет: CLI (-i) > .env (SCHEDULER_INTERVAL_MINUTES) > 0 по умолчанию
     interval_minutes = (
         args.interval_minutes
@@ -178,20 +650,133 @@ def main():
         else getattr(cfg, "scheduler_interval_minutes", 0)
     )
 
+    # Приоритет: CLI (--drain) > .env (SCHEDULER_DRAIN)
+    drain = args.drain if args.drain is not None else getattr(cfg, "scheduler_drain", False)
+
+    # Пул соединений и клиент MinIO живут весь процесс
+    runtime = Runtime(cfg)
+    if process_mode:
+        try:
+            runtime.image_pool
+            print(f"[MODEL] Пул изображений запущен: {cfg.pipeline.image_processes} процессов, модель {cfg.model_path}")
+        except Exception as e:
+            print(f"[MODEL][ERROR] Не удалось запустить пул изображений: {e}")
+
     if interval_minutes and interval_minutes > 0:
         interval_sec = interval_minutes * 60
-        print(f"[SCHEDULER] Запуск в цикле каждые {interval_minutes} мин. Нажмите Ctrl+C для остановки.")
+        mode = "с дренированием очереди" if drain else "по одной пачке"
+        print(f"[SCHEDULER] Запуск в цикле каждые {interval_minutes} мин ({mode}). Нажмите Ctrl+C для остановки.")
+        listener = _make_listener(cfg) if getattr(cfg, "scheduler_listen", False) else None
         try:
-            while True:
-                start_ts = time.strftime("%Y-%m-%d %H:%M:%S")
-                print(f"[SCHEDULER] Старт задачи: {start_ts}")
-                run_once(cfg)
-                print(f"[SCHEDULER] Сон {interval_minutes} мин...")
-                time.sleep(interval_sec)
+            _schedule_loop(cfg, runtime, interval_sec, drain, listener)
         except KeyboardInterrupt:
             print("[SCHEDULER] Остановка по запросу пользователя (Ctrl+C)")
+        finally:
+            if listener is not None:
+                listener.close()
+            runtime.close()
     else:
-        run_once(cfg)
+        try:
+            if drain:
+                _drain_queue(cfg, runtime)
+            else:
+                run_once(cfg, runtime)
+        finally:
+            runtime.close()
+
+
+def _drain_queue(cfg, runtime: Runtime) -> int:
+    """Запускает run_once подряд, пока очередь PAID не опустеет.
+
+    Очередь разобрана, когда захвачено меньше batch_limit объявлений: считаем
+    именно захваченные, а не обработанные, — отброшенные стадиями объявления
+    не должны останавливать разбор. Аренда без смены статуса не снимается
+    (см. save_ad_result), поэтому одно объявление не захватывается дважды.
+    Возвращает общее число обработанных объявлений.
+    """
+    total = 0
+    while True:
+        start_ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        print(f"[SCHEDULER] Старт задачи: {start_ts}")
+        claimed, processed = _run_batch(cfg, runtime)
+        total += processed
+        if claimed < cfg.batch_limit:
+            return total
+
+
+def _make_listener(cfg) -> PaidAdsListener:
+    channel = cfg.scheduler_notify_channel
+    if getattr(cfg, "scheduler_install_trigger", False):
+        try:
+            with get_conn(cfg.db) as conn:
+                install_paid_notify_trigger(conn, channel)
+            print(f"[SCHEDULER] Триггер NOTIFY на advertisement_auto установлен (канал {channel})")
+        except Exception as e:
+            print(f"[SCHEDULER][ERROR] Не удалось установить триггер NOTIFY: {e}")
+    print(f"[SCHEDULER] Ожидание уведомлений на канале {channel}, опрос по интервалу остаётся страховкой")
+    return PaidAdsListener(cfg.db, channel)
+
+
+def _schedule_loop(
+    cfg,
+    runtime: Runtime,
+    interval_sec: float,
+    drain: bool,
+    listener: Optional[PaidAdsListener] = None,
+    stop_event: Optional[threading.Event] = None,
+) -> None:
+    """Периодический запуск; время обработки засчитывается в интервал.
+
+    Без drain — одна пачка за интервал. С drain очередь разбирается до конца,
+    а затем ожидание растёт экспоненциально от SCHEDULER_MIN_BACKOFF_SECONDS
+    до интервала, пока пачки остаются пустыми, и сбрасывается при появлении работы.
+    С listener ожидание прерывается уведомлением о новом PAID-объявлении.
+
+    Сбой запуска (БД, MinIO и т.п.) не останавливает цикл: ошибка логируется,
+    аренда незаписанных объявлений снимается в run_once, а повтор идёт после
+    той же растущей паузы. Выход — только Ctrl+C или stop_event.
+    """
+    min_backoff = max(1.0, float(getattr(cfg, "scheduler_min_backoff_seconds", 5)))
+    backoff = min_backoff
+    while stop_event is None or not stop_event.is_set():
+        started = time.monotonic()
+        failed = False
+        try:
+            if drain:
+                processed = _drain_queue(cfg, runtime)
+            else:
+                start_ts = time.strftime("%Y-%m-%d %H:%M:%S")
+                print(f"[SCHEDULER] Старт задачи: {start_ts}")
+                processed = run_once(cfg, runtime)
+        except Exception as e:
+            logger.error("[SCHEDULER][ERROR] Run failed: %s", e, exc_info=True)
+            # Клиент MinIO пересоздаётся; соединения пула проверяются при выдаче
+            runtime.reset_minio()
+            processed = 0
+            failed = True
+        elapsed = time.monotonic() - started
+
+        if failed:
+            # После сбоя повторяем через растущую паузу, не дожидаясь полного интервала
+            backoff = min(backoff * 2, interval_sec)
+            wait_sec = backoff
+        elif drain:
+            # Пока объявления приходят — проверяем очередь часто, в простое — всё реже
+            backoff = min_backoff if processed else min(backoff * 2, interval_sec)
+            wait_sec = max(0.0, backoff - elapsed)
+        else:
+            backoff = min_backoff
+            wait_sec = max(0.0, interval_sec - elapsed)
+
+        print(f"[SCHEDULER] Обработано {processed} объявл. за {elapsed:.1f} с, сон {wait_sec:.1f} с...")
+        if stop_event is not None and listener is None:
+            stop_event.wait(wait_sec)
+        elif listener is None:
+            time.sleep(wait_sec)
+        else:
+            notified = listener.wait(wait_sec, coalesce=cfg.scheduler_notify_coalesce_seconds)
+            if notified:
+                print(f"[SCHEDULER] Получено уведомлений о PAID: {notified}, запуск без ожидания")
 
 
 if __name__ == "__main__":
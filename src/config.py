@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 import os
-from dataclasses import dataclass
+import socket
+from dataclasses import dataclass, field
 from typing import Optional
 
 
@@ -11,6 +12,19 @@ def _str_to_bool(val: Optional[str], default: bool = False) -> bool:
     return str(val).strip().lower() in {"1", "true", "yes", "y", "on"}
 
 
+def _decode_reduction(val: Optional[str]) -> int:
+    # auto -> 0, off -> 1, иначе делитель 2 | 4 | 8
+    val = str(val or "auto").strip().lower()
+    if val in {"", "auto"}:
+        return 0
+    if val in {"off", "no", "false", "none"}:
+        return 1
+    factor = int(val)
+    if factor not in (1, 2, 4, 8):
+        raise ValueError(f"DETECT_DECODE_REDUCTION must be auto, off, 2, 4 or 8, got: {val}")
+    return factor
+
+
 def _load_env_file(path: str) -> None:
     if not os.path.exists(path):
         return
@@ -35,6 +49,16 @@ class DbConfig:
     user: str
     password: str
     name: str
+    pool_min_size: int = 1
+    pool_max_size: int = 4
+    # Секционирование moderation_runs/detections/results по created_at (только при создании таблиц)
+    partitioning: bool = False
+    # month | day
+    partition_interval: str = "month"
+    # Сколько будущих секций создавать заранее
+    partitions_ahead: int = 2
+    # Хранить результаты модерации N дней (0 — бессрочно)
+    retention_days: int = 0
 
 
 @dataclass
@@ -47,19 +71,107 @@ class MinioConfig:
     client_public_access: bool = False
 
 
+@dataclass
+class PipelineConfig:
+    # Число потоков на стадию конвейера run_once и размер очередей между стадиями
+    download_workers: int = 2
+    text_workers: int = 1
+    image_workers: int = 1
+    upload_workers: int = 2
+    queue_size: int = 4
+    # Процессы для декодирования/инференса/кодирования изображений (0 — в потоках текущего процесса)
+    image_processes: int = 0
+    # Способ запуска процессов: forkserver | spawn (fork небезопасен в многопоточном процессе)
+    image_process_start_method: str = "forkserver"
+
+
+@dataclass
+class DetectorConfig:
+    # ultralytics | onnxruntime (без torch/ultralytics, напрямую через onnxruntime)
+    backend: str = "ultralytics"
+    conf: float = 0.25
+    iou: float = 0.7
+    # Потоки onnxruntime (0 — по умолчанию)
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    # none | dynamic | static — int8-вариант ONNX-модели (кэшируется рядом с моделью)
+    quantize: str = "none"
+    # Сторона входа модели (меньше — быстрее, но мелкие номера теряются)
+    imgsz: int = 640
+    # Калибровочные изображения для static (пусто — image_moderator/example)
+    calibration_dir: str = ""
+    # Декодирование JPEG в уменьшенном виде для детекции: 0 — авто по imgsz, 1 — выкл, 2/4/8
+    decode_reduction: int = 0
+
+
+@dataclass
+class CacheConfig:
+    enabled: bool = True
+    # Максимум записей в LRU процесса
+    max_entries: int = 10000
+    # Дублировать записи в таблицу PostgreSQL (переживают перезапуск и общие для воркеров)
+    persistent: bool = True
+    # Дополнительно искать совпадения по перцептивному хэшу
+    use_phash: bool = False
+    # Срок жизни записей постоянного кэша в днях (0 — без ограничения)
+    ttl_days: int = 0
+
+
 @dataclass
 class AppConfig:
     db: DbConfig
     minio: MinioConfig
     log: "LogConfig"
+    pipeline: PipelineConfig = field(default_factory=PipelineConfig)
+    detector: DetectorConfig = field(default_factory=DetectorConfig)
+    image_cache: CacheConfig = field(default_factory=CacheConfig)
+    text_cache: CacheConfig = field(default_factory=CacheConfig)
     batch_limit: int = 50
+    # Сколько объявлений захватывать из очереди PAID за один запрос (страница выборки)
+    fetch_page_size: int = 10
+    # Переиспользовать вердикт прошлого запуска при неизменном содержимом объявления
+    reuse_verdicts: bool = True
+    # Версия правил модерации: смена делает прошлые вердикты непригодными для переиспользования
+    moderation_version: str = "1"
+    # Порт HTTP-эндпоинта /metrics в формате Prometheus (0 — выключен) и адрес, на котором он слушает
+    metrics_port: int = 0
+    metrics_host: str = "127.0.0.1"
     clean_output_on_start: bool = False
     commit_results: bool = False
     # Интервал периодического запуска в минутах (0 — однократно)
     scheduler_interval_minutes: int = 0
+    # Разбирать очередь PAID до конца, а не по одной пачке за интервал
+    scheduler_drain: bool = False
+    # Минимальная пауза между проверками очереди в режиме drain, сек
+    scheduler_min_backoff_seconds: int = 5
+    # Пробуждение по LISTEN/NOTIFY вместо ожидания полного интервала
+    scheduler_listen: bool = False
+    scheduler_notify_channel: str = "advertisement_paid"
+    scheduler_notify_coalesce_seconds: float = 1.0
+    scheduler_install_trigger: bool = False
     # Пути
     model_path: str = ""
     output_folder: str = ""
+    # Размер пачки изображений для одного вызова детектора
+    detect_batch_size: int = 8
+    # Размер пачки текстов для одного вызова трансформера
+    text_batch_size: int = 16
+    # Параллельные загрузки изображений
+    download_concurrency: int = 8
+    download_per_host_limit: int = 4
+    # Сколько байт скачанных изображений одного объявления держать в памяти;
+    # сверх лимита файлы сбрасываются во временную папку (0 — без ограничения)
+    image_memory_limit_bytes: int = 0
+    # Параллельные загрузки покрытых изображений в MinIO
+    upload_concurrency: int = 4
+    upload_retries: int = 2
+    # Сколько объявлений записывать в БД одной транзакцией (пачка пишется через COPY)
+    persist_batch_size: int = 1
+    # Сбросить накопленные результаты, если самый старый ждёт дольше (0 — только по размеру)
+    persist_flush_seconds: float = 5.0
+    # Идентификатор воркера и срок аренды захваченных PAID-объявлений
+    worker_id: str = ""
+    claim_lease_seconds: int = 900
 
 
 @dataclass
@@ -86,6 +198,14 @@ def load_config() -> AppConfig:
     db_user = os.environ.get("DB_USER")
     db_password = os.environ.get("DB_PASSWORD")
     db_name = os.environ.get("DB_NAME")
+    db_pool_min_size = max(0, int(os.environ.get("DB_POOL_MIN_SIZE", "1")))
+    db_pool_max_size = max(1, db_pool_min_size, int(os.environ.get("DB_POOL_MAX_SIZE", "4")))
+    db_partitioning = _str_to_bool(os.environ.get("DB_PARTITIONING"), False)
+    db_partition_interval = os.environ.get("DB_PARTITION_INTERVAL", "month").strip().lower()
+    if db_partition_interval not in {"month", "day"}:
+        raise RuntimeError(f"DB_PARTITION_INTERVAL must be month or day, got: {db_partition_interval}")
+    db_partitions_ahead = max(0, int(os.environ.get("DB_PARTITIONS_AHEAD", "2")))
+    db_retention_days = max(0, int(os.environ.get("DB_RETENTION_DAYS", "0")))
 
     for k, v in {
         "DB_HOST": db_host,
@@ -102,6 +222,12 @@ def load_config() -> AppConfig:
         user=db_user,
         password=db_password,
         name=db_name,
+        pool_min_size=db_pool_min_size,
+        pool_max_size=db_pool_max_size,
+        partitioning=db_partitioning,
+        partition_interval=db_partition_interval,
+        partitions_ahead=db_partitions_ahead,
+        retention_days=db_retention_days,
     )
 
     # MinIO
@@ -154,25 +280,111 @@ def load_config() -> AppConfig:
         backup_count=log_backup_count,
     )
 
+    # Pipeline
+    pipeline_cfg = PipelineConfig(
+        download_workers=max(1, int(os.environ.get("PIPELINE_DOWNLOAD_WORKERS", "2"))),
+        text_workers=max(1, int(os.environ.get("PIPELINE_TEXT_WORKERS", "1"))),
+        image_workers=max(1, int(os.environ.get("PIPELINE_IMAGE_WORKERS", "1"))),
+        upload_workers=max(1, int(os.environ.get("PIPELINE_UPLOAD_WORKERS", "2"))),
+        queue_size=max(1, int(os.environ.get("PIPELINE_QUEUE_SIZE", "4"))),
+        image_processes=max(0, int(os.environ.get("IMAGE_PROCESS_WORKERS", "0"))),
+        image_process_start_method=os.environ.get("IMAGE_PROCESS_START_METHOD", "forkserver").strip().lower(),
+    )
+
+    # Detector
+    detector_cfg = DetectorConfig(
+        backend=os.environ.get("DETECTOR_BACKEND", "ultralytics").strip().lower(),
+        conf=float(os.environ.get("DETECTOR_CONF", "0.25")),
+        iou=float(os.environ.get("DETECTOR_IOU", "0.7")),
+        intra_op_threads=max(0, int(os.environ.get("DETECTOR_INTRA_OP_THREADS", "0"))),
+        inter_op_threads=max(0, int(os.environ.get("DETECTOR_INTER_OP_THREADS", "0"))),
+        quantize=os.environ.get("DETECTOR_QUANTIZE", "none").strip().lower(),
+        imgsz=max(32, int(os.environ.get("DETECTOR_IMGSZ", "640"))),
+        calibration_dir=os.environ.get("DETECTOR_CALIBRATION_DIR", ""),
+        decode_reduction=_decode_reduction(os.environ.get("DETECT_DECODE_REDUCTION")),
+    )
+
+    # Caches
+    image_cache_cfg = CacheConfig(
+        enabled=_str_to_bool(os.environ.get("IMAGE_CACHE_ENABLED"), True),
+        max_entries=max(1, int(os.environ.get("IMAGE_CACHE_SIZE", "10000"))),
+        persistent=_str_to_bool(os.environ.get("IMAGE_CACHE_PERSISTENT"), True),
+        use_phash=_str_to_bool(os.environ.get("IMAGE_CACHE_PHASH"), False),
+        ttl_days=max(0, int(os.environ.get("IMAGE_CACHE_TTL_DAYS", "30"))),
+    )
+    text_cache_cfg = CacheConfig(
+        enabled=_str_to_bool(os.environ.get("TEXT_CACHE_ENABLED"), True),
+        max_entries=max(1, int(os.environ.get("TEXT_CACHE_SIZE", "10000"))),
+        persistent=_str_to_bool(os.environ.get("TEXT_CACHE_PERSISTENT"), False),
+    )
+
     batch_limit = int(os.environ.get("BATCH_LIMIT", "50"))
+    fetch_page_size = max(1, int(os.environ.get("FETCH_PAGE_SIZE", "10")))
+    reuse_verdicts = _str_to_bool(os.environ.get("REUSE_VERDICTS"), True)
+    moderation_version = os.environ.get("MODERATION_VERSION", "1").strip()
+    metrics_port = max(0, int(os.environ.get("METRICS_PORT", "0")))
+    metrics_host = os.environ.get("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1"
     clean_output_on_start = _str_to_bool(os.environ.get("CLEAN_OUTPUT_ON_START"), False)
     commit_results = _str_to_bool(os.environ.get("COMMIT_RESULTS"), False)
     scheduler_interval_minutes = int(os.environ.get("SCHEDULER_INTERVAL_MINUTES", "0"))
+    scheduler_drain = _str_to_bool(os.environ.get("SCHEDULER_DRAIN"), False)
+    scheduler_min_backoff_seconds = max(1, int(os.environ.get("SCHEDULER_MIN_BACKOFF_SECONDS", "5")))
+    scheduler_listen = _str_to_bool(os.environ.get("SCHEDULER_LISTEN"), False)
+    scheduler_notify_channel = os.environ.get("SCHEDULER_NOTIFY_CHANNEL", "advertisement_paid")
+    scheduler_notify_coalesce_seconds = max(0.0, float(os.environ.get("SCHEDULER_NOTIFY_COALESCE_SECONDS", "1")))
+    scheduler_install_trigger = _str_to_bool(os.environ.get("SCHEDULER_INSTALL_TRIGGER"), False)
 
     # Пути (с дефолтами относительно src)
     default_output = os.path.join(root, "image_moderator", "output")
     default_model = os.path.join(root, "image_moderator", "models", "license-plate-finetune-v1l.onnx")
     model_path = os.environ.get("MODEL_PATH", default_model)
     output_folder = os.environ.get("OUTPUT_FOLDER", default_output)
+    detect_batch_size = max(1, int(os.environ.get("DETECT_BATCH_SIZE", "8")))
+    text_batch_size = max(1, int(os.environ.get("TEXT_BATCH_SIZE", "16")))
+    download_concurrency = max(1, int(os.environ.get("DOWNLOAD_CONCURRENCY", "8")))
+    download_per_host_limit = max(1, int(os.environ.get("DOWNLOAD_PER_HOST_LIMIT", "4")))
+    image_memory_limit_bytes = max(0, int(os.environ.get("IMAGE_MEMORY_LIMIT_BYTES", "0")))
+    upload_concurrency = max(1, int(os.environ.get("UPLOAD_CONCURRENCY", "4")))
+    upload_retries = max(0, int(os.environ.get("UPLOAD_RETRIES", "2")))
+    persist_batch_size = max(1, int(os.environ.get("PERSIST_BATCH_SIZE", "1")))
+    persist_flush_seconds = max(0.0, float(os.environ.get("PERSIST_FLUSH_SECONDS", "5")))
+    worker_id = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+    claim_lease_seconds = max(1, int(os.environ.get("CLAIM_LEASE_SECONDS", "900")))
 
     return AppConfig(
         db=db_cfg,
         minio=minio_cfg,
         log=log_cfg,
+        pipeline=pipeline_cfg,
+        detector=detector_cfg,
+        image_cache=image_cache_cfg,
+        text_cache=text_cache_cfg,
         batch_limit=batch_limit,
+        fetch_page_size=fetch_page_size,
+        reuse_verdicts=reuse_verdicts,
+        moderation_version=moderation_version,
+        metrics_port=metrics_port,
+        metrics_host=metrics_host,
         clean_output_on_start=clean_output_on_start,
         commit_results=commit_results,
         scheduler_interval_minutes=scheduler_interval_minutes,
+        scheduler_drain=scheduler_drain,
+        scheduler_min_backoff_seconds=scheduler_min_backoff_seconds,
+        scheduler_listen=scheduler_listen,
+        scheduler_notify_channel=scheduler_notify_channel,
+        scheduler_notify_coalesce_seconds=scheduler_notify_coalesce_seconds,
+        scheduler_install_trigger=scheduler_install_trigger,
         model_path=model_path,
         output_folder=output_folder,
+        detect_batch_size=detect_batch_size,
+        text_batch_size=text_batch_size,
+        download_concurrency=download_concurrency,
+        download_per_host_limit=download_per_host_limit,
+        image_memory_limit_bytes=image_memory_limit_bytes,
+        upload_concurrency=upload_concurrency,
+        upload_retries=upload_retries,
+        persist_batch_size=persist_batch_size,
+        persist_flush_seconds=persist_flush_seconds,
+        worker_id=worker_id,
+        claim_lease_seconds=claim_lease_seconds,
     )
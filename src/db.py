@@ -1,68 +1,209 @@
 from __future__ import annotations
 
 import json
-from typing import Iterable, List, Dict, Tuple, Optional
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, Dict, Tuple, Optional
 
 import psycopg
+from psycopg import sql
+from psycopg_pool import ConnectionPool
 
 from .config import DbConfig
 
 
-def get_conn(cfg: DbConfig) -> psycopg.Connection:
+def get_conn(cfg: DbConfig, autocommit: bool = False) -> psycopg.Connection:
     return psycopg.connect(
         host=cfg.host,
         port=cfg.port,
         user=cfg.user,
         password=cfg.password,
         dbname=cfg.name,
+        autocommit=autocommit,
     )
 
 
+def make_pool(cfg: DbConfig, min_max_size: int = 0) -> ConnectionPool:
+    """Пул соединений на всё время работы процесса.
+
+    Соединение проверяется при выдаче из пула; оборванные заменяются новыми.
+    min_max_size — нижняя граница max_size (сколько соединений нужно
+    одновременно вызывающему, см. Runtime.required_connections).
+    """
+    return ConnectionPool(
+        kwargs={
+            "host": cfg.host,
+            "port": cfg.port,
+            "user": cfg.user,
+            "password": cfg.password,
+            "dbname": cfg.name,
+        },
+        min_size=cfg.pool_min_size,
+        max_size=max(cfg.pool_max_size, cfg.pool_min_size, int(min_max_size)),
+        check=ConnectionPool.check_connection,
+        open=True,
+    )
+
+
+# Таблицы результатов, которые можно секционировать по created_at
+PARTITIONED_TABLES = ("moderation_runs", "moderation_detections", "moderation_results")
+
+
+def _table_kind(conn: psycopg.Connection, table: str) -> Optional[str]:
+    """relkind таблицы: 'r' — обычная, 'p' — секционированная, None — таблицы нет."""
+    row = conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,)).fetchone()
+    return row[0] if row else None
+
+
 def init_db(cfg: DbConfig) -> None:
-    ddl_runs = (
+    # Секционированные таблицы создаются только с нуля: в этом режиме у них нет
+    # внешних ключей (уникальность id держится вместе с created_at), а у детекций
+    # есть свой created_at, чтобы все три таблицы делились на секции одинаково
+    with get_conn(cfg) as conn:
+        runs_kind = _table_kind(conn, "moderation_runs")
+    partitioned = runs_kind == "p" or (runs_kind is None and cfg.partitioning)
+    if cfg.partitioning and not partitioned:
+        logging.getLogger(__name__).warning(
+            "[DB][SCHEMA] moderation_* tables already exist unpartitioned; DB_PARTITIONING needs a manual migration"
+        )
+
+    if partitioned:
+        ddl_runs = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_runs
+            (
+                id           BIGSERIAL,
+                created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                acceptable   BOOLEAN     NOT NULL,
+                source_id    TEXT,
+                verdict_json JSONB,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            """
+        )
+
+        ddl_detections = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_detections
+            (
+                id         BIGSERIAL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                run_id     BIGINT      NOT NULL,
+                type       TEXT,
+                category   TEXT,
+                value      TEXT,
+                image_path TEXT,
+                object_key TEXT,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            """
+        )
+
+        ddl_results = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_results
+            (
+                id               BIGSERIAL,
+                created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                ad_id            TEXT        NOT NULL,
+                run_id           BIGINT      NOT NULL,
+                acceptable       BOOLEAN     NOT NULL,
+                text_acceptable  BOOLEAN     NOT NULL,
+                image_acceptable BOOLEAN     NOT NULL,
+                total_detections INT         NOT NULL DEFAULT 0,
+                text_detections  INT         NOT NULL DEFAULT 0,
+                image_detections INT         NOT NULL DEFAULT 0,
+                text_summary     JSONB,
+                image_summary    JSONB,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at);
+            """
+        )
+    else:
+        ddl_runs = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_runs
+            (
+                id           BIGSERIAL PRIMARY KEY,
+                created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                acceptable   BOOLEAN     NOT NULL,
+                source_id    TEXT,
+                verdict_json JSONB
+            );
+            """
+        )
+
+        ddl_detections = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_detections
+            (
+                id         BIGSERIAL PRIMARY KEY,
+                run_id     BIGINT NOT NULL REFERENCES moderation_runs (id) ON DELETE CASCADE,
+                type       TEXT,
+                category   TEXT,
+                value      TEXT,
+                image_path TEXT,
+                object_key TEXT
+            );
+            """
+        )
+
+        ddl_results = (
+            """
+            CREATE TABLE IF NOT EXISTS moderation_results
+            (
+                id               BIGSERIAL PRIMARY KEY,
+                created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                ad_id            TEXT        NOT NULL,
+                run_id           BIGINT      NOT NULL REFERENCES moderation_runs (id) ON DELETE CASCADE,
+                acceptable       BOOLEAN     NOT NULL,
+                text_acceptable  BOOLEAN     NOT NULL,
+                image_acceptable BOOLEAN     NOT NULL,
+                total_detections INT         NOT NULL DEFAULT 0,
+                text_detections  INT         NOT NULL DEFAULT 0,
+                image_detections INT         NOT NULL DEFAULT 0,
+                text_summary     JSONB,
+                image_summary    JSONB
+            );
+            """
+        )
+
+    # Аренда объявлений воркерами: строка живёт, пока объявление в работе
+    ddl_claims = (
         """
-        CREATE TABLE IF NOT EXISTS moderation_runs
+        CREATE TABLE IF NOT EXISTS moderation_claims
         (
-            id           BIGSERIAL PRIMARY KEY,
-            created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            acceptable   BOOLEAN     NOT NULL,
-            source_id    TEXT,
-            verdict_json JSONB
+            ad_id       TEXT PRIMARY KEY,
+            claimed_by  TEXT        NOT NULL,
+            claimed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            lease_until TIMESTAMPTZ NOT NULL
         );
         """
     )
 
-    ddl_detections = (
+    # Кэш детекций по хэшу содержимого изображения
+    ddl_image_cache = (
         """
-        CREATE TABLE IF NOT EXISTS moderation_detections
+        CREATE TABLE IF NOT EXISTS image_detection_cache
         (
-            id         BIGSERIAL PRIMARY KEY,
-            run_id     BIGINT NOT NULL REFERENCES moderation_runs (id) ON DELETE CASCADE,
-            type       TEXT,
-            category   TEXT,
-            value      TEXT,
-            image_path TEXT,
-            object_key TEXT
+            content_hash TEXT PRIMARY KEY,
+            phash        TEXT,
+            boxes        JSONB       NOT NULL DEFAULT '[]'::jsonb,
+            object_key   TEXT,
+            created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
         );
         """
     )
 
-    ddl_results = (
+    # Кэш результатов текстовой модерации
+    ddl_text_cache = (
         """
-        CREATE TABLE IF NOT EXISTS moderation_results
+        CREATE TABLE IF NOT EXISTS text_moderation_cache
         (
-            id               BIGSERIAL PRIMARY KEY,
-            created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            ad_id            TEXT        NOT NULL,
-            run_id           BIGINT      NOT NULL REFERENCES moderation_runs (id) ON DELETE CASCADE,
-            acceptable       BOOLEAN     NOT NULL,
-            text_acceptable  BOOLEAN     NOT NULL,
-            image_acceptable BOOLEAN     NOT NULL,
-            total_detections INT         NOT NULL DEFAULT 0,
-            text_detections  INT         NOT NULL DEFAULT 0,
-            image_detections INT         NOT NULL DEFAULT 0,
-            text_summary     JSONB,
-            image_summary    JSONB
+            cache_key  TEXT PRIMARY KEY,
+            detections JSONB       NOT NULL DEFAULT '[]'::jsonb,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
         );
         """
     )
@@ -72,7 +213,374 @@ def init_db(cfg: DbConfig) -> None:
             cur.execute(ddl_runs)
             cur.execute(ddl_detections)
             cur.execute(ddl_results)
+            # Отпечатки содержимого объявления для повторной модерации без изменений
+            cur.execute(
+                """
+                ALTER TABLE moderation_runs
+                    ADD COLUMN IF NOT EXISTS content_fingerprint TEXT,
+                    ADD COLUMN IF NOT EXISTS text_fingerprint    TEXT;
+                """
+            )
+            cur.execute(ddl_claims)
+            cur.execute(ddl_image_cache)
+            # Записи кэша действительны только для детектора, которым получены
+            cur.execute(
+                """
+                ALTER TABLE image_detection_cache
+                    ADD COLUMN IF NOT EXISTS detector TEXT NOT NULL DEFAULT '';
+                """
+            )
+            cur.execute(ddl_text_cache)
+        conn.commit()
+        if partitioned:
+            ensure_partitions(conn, cfg.partition_interval, cfg.partitions_ahead)
+    ensure_indexes(cfg)
+
+
+# Поиск по объявлению, каскадное удаление запусков, выборки по времени
+# (BRIN: строки пишутся по возрастанию created_at, индекс крошечный) и кэш детекций
+_INDEXES = (
+    ("moderation_runs_source_id_idx", "moderation_runs", "(source_id, created_at DESC)"),
+    ("moderation_runs_created_at_brin", "moderation_runs", "USING brin (created_at)"),
+    ("moderation_detections_run_id_idx", "moderation_detections", "(run_id)"),
+    ("moderation_results_ad_id_idx", "moderation_results", "(ad_id, created_at DESC)"),
+    ("moderation_results_run_id_idx", "moderation_results", "(run_id)"),
+    ("moderation_results_created_at_brin", "moderation_results", "USING brin (created_at)"),
+    ("image_detection_cache_phash_idx", "image_detection_cache", "(phash) WHERE phash IS NOT NULL"),
+    ("image_detection_cache_created_at_idx", "image_detection_cache", "(created_at)"),
+)
+
+
+def ensure_indexes(cfg: DbConfig) -> int:
+    """Создаёт недостающие индексы вне транзакции схемы.
+
+    На обычных таблицах индекс строится CREATE INDEX CONCURRENTLY (нужен
+    autocommit): первый запуск на большой существующей таблице не блокирует
+    запись остальных воркеров. Секционированные таблицы создаются с нуля,
+    и CONCURRENTLY для них PostgreSQL не поддерживает, поэтому там индекс
+    строится обычным запросом. Недостроенный индекс прерванной сборки
+    (indisvalid = false) удаляется и строится заново.
+    Возвращает число построенных индексов.
+    """
+    logger = logging.getLogger(__name__)
+    built = 0
+    with get_conn(cfg, autocommit=True) as conn:
+        for name, table, definition in _INDEXES:
+            kind = _table_kind(conn, table)
+            if kind is None:
+                continue
+            row = conn.execute(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,)
+            ).fetchone()
+            if row is not None and row[0]:
+                continue
+            concurrently = sql.SQL("") if kind == "p" else sql.SQL(" CONCURRENTLY")
+            if row is not None:
+                logger.warning("[DB][SCHEMA] index %s is invalid, rebuilding", name)
+                conn.execute(sql.SQL("DROP INDEX{} IF EXISTS {}").format(concurrently, sql.Identifier(name)))
+            conn.execute(
+                sql.SQL("CREATE INDEX{} IF NOT EXISTS {} ON {} ").format(
+                    concurrently, sql.Identifier(name), sql.Identifier(table)
+                ) + sql.SQL(definition)
+            )
+            built += 1
+            logger.info("[DB][SCHEMA] index %s built", name)
+    return built
+
+
+def _period_start(moment: datetime, interval: str) -> date:
+    day = moment.astimezone(timezone.utc).date()
+    return day if interval == "day" else day.replace(day=1)
+
+
+def _next_period(start: date, interval: str) -> date:
+    if interval == "day":
+        return start + timedelta(days=1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def _partition_name(table: str, start: date, interval: str) -> str:
+    return f"{table}_p{start:%Y%m%d}" if interval == "day" else f"{table}_p{start:%Y%m}"
+
+
+def _partition_range(name: str) -> Optional[Tuple[date, date]]:
+    """Границы секции по её имени (<таблица>_pYYYYMM или _pYYYYMMDD); None — не наша секция."""
+    suffix = name.rsplit("_p", 1)[-1]
+    try:
+        if len(suffix) == 8:
+            start = datetime.strptime(suffix, "%Y%m%d").date()
+            return start, _next_period(start, "day")
+        if len(suffix) == 6:
+            start = datetime.strptime(suffix, "%Y%m").date()
+            return start, _next_period(start, "month")
+    except ValueError:
+        pass
+    return None
+
+
+def ensure_partitions(
+        conn: psycopg.Connection,
+        interval: str = "month",
+        ahead: int = 2,
+        now: Optional[datetime] = None,
+) -> int:
+    """Создаёт секции текущего и ahead следующих периодов (UTC) у секционированных таблиц.
+
+    Секцию DEFAULT не создаём: при ней PostgreSQL не умеет отсоединять секции
+    CONCURRENTLY (см. apply_retention), а запас в ahead периодов покрывает
+    запись, пока обслуживание запускается хотя бы раз за период. Секцию, чей
+    диапазон уже есть в DEFAULT от прежних версий, PostgreSQL не создаст —
+    такой период пропускается с предупреждением.
+    Возвращает число созданных секций (вместе с уже существующими).
+    """
+    logger = logging.getLogger(__name__)
+    now = now or datetime.now(timezone.utc)
+    created = 0
+    for table in PARTITIONED_TABLES:
+        if _table_kind(conn, table) != "p":
+            continue
+        start = _period_start(now, interval)
+        for _ in range(max(0, int(ahead)) + 1):
+            end = _next_period(start, interval)
+            try:
+                with conn.transaction():
+                    conn.execute(
+                        sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})").format(
+                            sql.Identifier(_partition_name(table, start, interval)),
+                            sql.Identifier(table),
+                            sql.Literal(f"{start.isoformat()} 00:00:00+00"),
+                            sql.Literal(f"{end.isoformat()} 00:00:00+00"),
+                        )
+                    )
+                created += 1
+            except psycopg.Error as e:
+                logger.warning("[DB][PARTITION] %s %s..%s not created: %s", table, start, end, e)
+            start = end
+    conn.commit()
+    return created
+
+
+def apply_retention(
+        conn: psycopg.Connection,
+        retention_days: int,
+        chunk_size: int = 10000,
+        now: Optional[datetime] = None,
+        lock_timeout: str = "5s",
+) -> int:
+    """Удаляет результаты модерации старше retention_days.
+
+    У секционированных таблиц секции, период которых закончился до границы
+    хранения, сначала отсоединяются (DETACH PARTITION CONCURRENTLY — без
+    ACCESS EXCLUSIVE на родительской таблице, запись не ждёт), затем удаляются
+    целиком. Если у таблицы осталась секция DEFAULT от прежних версий,
+    CONCURRENTLY недоступен: секция отсоединяется обычным DETACH с lock_timeout,
+    а при занятой таблице пропускается до следующего обслуживания; старые строки
+    из DEFAULT удаляются запросом. Несекционированные таблицы чистятся порциями
+    по chunk_size запусков (детекции и результаты удаляются каскадом).
+    Возвращает число удалённых секций или запусков.
+
+    Вызывать вне пути обработки пачки (Runtime.maintain): построчное удаление
+    и ожидание DETACH могут занимать минуты.
+    """
+    if retention_days <= 0:
+        return 0
+    logger = logging.getLogger(__name__)
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    removed = 0
+
+    if _table_kind(conn, "moderation_runs") == "p":
+        # DETACH ... CONCURRENTLY нельзя выполнять внутри транзакции
         conn.commit()
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            conn.execute(sql.SQL("SET lock_timeout = {}").format(sql.Literal(lock_timeout)))
+            for table in PARTITIONED_TABLES:
+                if _table_kind(conn, table) != "p":
+                    continue
+                default = f"{table}_default"
+                has_default = _table_kind(conn, default) is not None
+                rows = conn.execute(
+                    """
+                    SELECT c.relname, i.inhdetachpending
+                    FROM pg_inherits i
+                             JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = %s::regclass
+                    """,
+                    (table,),
+                ).fetchall()
+                for name, pending in rows:
+                    bounds = _partition_range(name)
+                    if bounds is None or bounds[1] > cutoff.date():
+                        continue
+                    if pending:
+                        # Прерванный DETACH CONCURRENTLY доводится до конца отдельной командой
+                        detach = "ALTER TABLE {} DETACH PARTITION {} FINALIZE"
+                    elif has_default:
+                        detach = "ALTER TABLE {} DETACH PARTITION {}"
+                    else:
+                        detach = "ALTER TABLE {} DETACH PARTITION {} CONCURRENTLY"
+                    try:
+                        conn.execute(sql.SQL(detach).format(sql.Identifier(table), sql.Identifier(name)))
+                    except psycopg.errors.LockNotAvailable:
+                        logger.warning("[DB][RETENTION] %s is busy, partition %s kept until next run", table, name)
+                        continue
+                    conn.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+                    removed += 1
+                    logger.info("[DB][RETENTION] dropped partition %s", name)
+                if has_default:
+                    conn.execute(
+                        sql.SQL("DELETE FROM {} WHERE created_at < %s").format(sql.Identifier(default)),
+                        (cutoff,),
+                    )
+        finally:
+            conn.execute("RESET lock_timeout")
+            conn.autocommit = autocommit
+        return removed
+
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE
+                FROM moderation_runs
+                WHERE id IN (SELECT id
+                             FROM moderation_runs
+                             WHERE created_at < %s
+                             ORDER BY created_at
+                             LIMIT %s)
+                """,
+                (cutoff, chunk_size),
+            )
+            deleted = cur.rowcount
+        # Коммит после каждой порции: короткие блокировки и умеренный WAL
+        conn.commit()
+        removed += deleted
+        if deleted < chunk_size:
+            break
+    if removed:
+        logger.info("[DB][RETENTION] deleted %d runs older than %s", removed, cutoff.isoformat())
+    return removed
+
+
+def prune_image_cache(
+        conn: psycopg.Connection,
+        detector: str,
+        ttl_days: int = 0,
+        chunk_size: int = 10000,
+) -> int:
+    """Удаляет из image_detection_cache записи другого детектора и (при ttl_days > 0) старше ttl_days.
+
+    Удаление идёт порциями по chunk_size с коммитом после каждой. Возвращает число удалённых записей.
+    """
+    removed = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                DELETE
+                FROM image_detection_cache
+                WHERE content_hash IN (SELECT content_hash
+                                       FROM image_detection_cache
+                                       WHERE detector <> %(detector)s
+                                          OR (%(ttl)s > 0 AND created_at < NOW() - make_interval(days => %(ttl)s))
+                                       LIMIT %(limit)s)
+                """,
+                {"detector": detector, "ttl": int(ttl_days), "limit": chunk_size},
+            )
+            deleted = cur.rowcount
+        conn.commit()
+        removed += deleted
+        if deleted < chunk_size:
+            break
+    if removed:
+        logging.getLogger(__name__).info("[DB][CACHE] pruned %d image cache entries", removed)
+    return removed
+
+
+def install_paid_notify_trigger(conn: psycopg.Connection, channel: str) -> None:
+    """Создаёт триггер на advertisement_auto, шлющий NOTIFY при переходе объявления в PAID.
+
+    Полезная нагрузка уведомления — id объявления.
+    """
+    ddl_func = """
+        CREATE OR REPLACE FUNCTION moderation_notify_paid() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM NEW.status THEN
+                PERFORM pg_notify(TG_ARGV[0], NEW.id::text);
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """
+    ddl_trigger = sql.SQL(
+        """
+        CREATE TRIGGER moderation_notify_paid
+            AFTER INSERT OR UPDATE OF status
+            ON advertisement_auto
+            FOR EACH ROW
+            WHEN (NEW.status = 'PAID')
+        EXECUTE FUNCTION moderation_notify_paid({channel});
+        """
+    ).format(channel=sql.Literal(channel))
+
+    with conn.cursor() as cur:
+        cur.execute(ddl_func)
+        cur.execute("DROP TRIGGER IF EXISTS moderation_notify_paid ON advertisement_auto")
+        cur.execute(ddl_trigger)
+    conn.commit()
+
+
+class PaidAdsListener:
+    """LISTEN на канале уведомлений о новых PAID-объявлениях.
+
+    Держит отдельное autocommit-соединение; при обрыве переподключается
+    на следующем wait(). Если соединение недоступно, wait() просто спит
+    timeout, так что опрос по интервалу продолжает работать.
+    """
+
+    def __init__(self, cfg: DbConfig, channel: str):
+        self.cfg = cfg
+        self.channel = channel
+        self._conn: Optional[psycopg.Connection] = None
+        self._logger = logging.getLogger(__name__)
+
+    def _ensure(self) -> psycopg.Connection:
+        if self._conn is None or self._conn.closed:
+            conn = get_conn(self.cfg, autocommit=True)
+            conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+            self._conn = conn
+            self._logger.info("[DB][LISTEN] channel=%s", self.channel)
+        return self._conn
+
+    def wait(self, timeout: float, coalesce: float = 1.0) -> int:
+        """Ждёт уведомление не дольше timeout секунд.
+
+        После первого уведомления ещё coalesce секунд собирает остальные,
+        чтобы пачка уведомлений приводила к одному запуску.
+        Возвращает число полученных уведомлений (0 — истёк таймаут).
+        """
+        timeout = max(0.0, float(timeout))
+        started = time.monotonic()
+        try:
+            conn = self._ensure()
+            received = sum(1 for _ in conn.notifies(timeout=timeout, stop_after=1))
+            if received and coalesce > 0:
+                received += sum(1 for _ in conn.notifies(timeout=coalesce))
+            return received
+        except psycopg.Error as e:
+            self._logger.warning("[DB][LISTEN][ERROR] channel=%s error=%s", self.channel, e)
+            self.close()
+            time.sleep(max(0.0, timeout - (time.monotonic() - started)))
+            return 0
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
 
 
 def health_check(cfg: DbConfig) -> bool:
@@ -107,6 +615,162 @@ def fetch_paid_ads(
         return [(str(r[0]), r[1], r[2]) for r in cur.fetchall()]
 
 
+_CLAIM_PAGE_SQL = """
+WITH candidates AS (
+    SELECT au.id
+    FROM advertisement_auto au
+             LEFT JOIN moderation_claims c ON c.ad_id = au.id::text
+    WHERE au.status = 'PAID'
+      AND (c.ad_id IS NULL OR c.lease_until < NOW())
+      AND EXISTS (SELECT 1 FROM advertisement_images ai WHERE ai.advertisement_id = au.id)
+      AND (%(first)s OR (au.created_at, au.id) > (%(after_created_at)s, %(after_id)s))
+    ORDER BY au.created_at, au.id
+    LIMIT %(limit)s
+    FOR UPDATE OF au SKIP LOCKED
+),
+claimed AS (
+    INSERT INTO moderation_claims (ad_id, claimed_by, lease_until)
+    SELECT id::text, %(worker_id)s, NOW() + make_interval(secs => %(lease)s)
+    FROM candidates
+    ON CONFLICT (ad_id) DO UPDATE
+        SET claimed_by  = EXCLUDED.claimed_by,
+            claimed_at  = NOW(),
+            lease_until = EXCLUDED.lease_until
+        WHERE moderation_claims.lease_until < NOW()
+    RETURNING ad_id
+)
+SELECT au.id,
+       au.created_at,
+       au.description,
+       COALESCE(array_agg(ai.image_url) FILTER (WHERE ai.image_url IS NOT NULL AND ai.image_url <> ''), '{}')
+FROM claimed c
+         -- Обратно к объявлению через candidates: au.id сравнивается в родном типе и идёт по индексу
+         JOIN candidates ca ON ca.id::text = c.ad_id
+         JOIN advertisement_auto au ON au.id = ca.id
+         JOIN advertisement_images ai ON au.id = ai.advertisement_id
+GROUP BY au.id, au.created_at, au.description
+ORDER BY au.created_at, au.id
+"""
+
+
+def claim_paid_ads_page(
+    conn: psycopg.Connection,
+    limit: int,
+    worker_id: str,
+    lease_seconds: int = 900,
+    after: Optional[Tuple[object, object]] = None,
+) -> List[Tuple[str, str, List[str], Tuple[object, object]]]:
+    """Захватывает страницу PAID-объявлений после ключа after = (created_at, id).
+
+    Объявление захватывается строкой в moderation_claims со сроком аренды
+    lease_until, поэтому несколько воркеров не возьмут одно и то же объявление.
+    Изображения собираются в массив на стороне PostgreSQL (одна строка
+    на объявление), выборка идёт по ключу (created_at, id) без OFFSET.
+
+    Возвращает (id, description, image_urls, ключ) в порядке очереди; ключ
+    последней строки передаётся в after для следующей страницы.
+    """
+    params = {
+        "limit": limit,
+        "worker_id": worker_id,
+        "lease": float(lease_seconds),
+        "first": after is None,
+        "after_created_at": after[0] if after else None,
+        "after_id": after[1] if after else None,
+    }
+    try:
+        with conn.cursor() as cur:
+            cur.execute(_CLAIM_PAGE_SQL, params)
+            rows = [
+                (str(ad_id), description or "", list(urls or []), (created_at, ad_id))
+                for ad_id, created_at, description, urls in cur.fetchall()
+            ]
+        # Фиксируем захват сразу: снимаем блокировки и делаем аренду видимой остальным
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+
+def iter_claimed_ads(
+    conn: psycopg.Connection,
+    worker_id: str,
+    lease_seconds: int = 900,
+    limit: int = 50,
+    page_size: int = 10,
+) -> Iterator[List[Tuple[str, str, List[str]]]]:
+    """Генератор страниц захваченных PAID-объявлений: [(id, description, image_urls), ...].
+
+    Следующая страница захватывается только когда потребитель попросит её,
+    поэтому первое объявление уходит в обработку, не дожидаясь всей выборки,
+    а аренда берётся ближе к фактической обработке. Всего не более limit объявлений.
+    """
+    page_size = max(1, int(page_size or 1))
+    remaining = max(0, int(limit))
+    after = None
+    while remaining > 0:
+        page = claim_paid_ads_page(conn, min(page_size, remaining), worker_id, lease_seconds, after)
+        if not page:
+            return
+        remaining -= len(page)
+        after = page[-1][3]
+        yield [(ad_id, description, urls) for ad_id, description, urls, _ in page]
+
+
+def fetch_previous_runs(
+    conn: psycopg.Connection,
+    ad_ids: Iterable[str],
+) -> Dict[str, Tuple[int, Optional[str], Optional[str], dict]]:
+    """Последний запуск модерации по каждому объявлению.
+
+    Возвращает {ad_id: (run_id, content_fingerprint, text_fingerprint, verdict)}.
+    Использует индекс moderation_runs (source_id, created_at DESC).
+    """
+    ids = [str(a) for a in ad_ids]
+    if not ids:
+        return {}
+    rows = conn.execute(
+        """
+        SELECT DISTINCT ON (source_id) source_id, id, content_fingerprint, text_fingerprint, verdict_json
+        FROM moderation_runs
+        WHERE source_id = ANY(%s::text[])
+        ORDER BY source_id, created_at DESC, id DESC
+        """,
+        (ids,),
+    ).fetchall()
+    # Чтение без изменений: не держим транзакцию открытой
+    conn.commit()
+    return {
+        source_id: (int(run_id), content_fp, text_fp, verdict or {})
+        for source_id, run_id, content_fp, text_fp, verdict in rows
+    }
+
+
+def oldest_paid_age_seconds(conn: psycopg.Connection) -> float:
+    """Возраст самого старого объявления в статусе PAID в секундах (0, если очередь пуста)."""
+    row = conn.execute(
+        "SELECT EXTRACT(EPOCH FROM NOW() - MIN(created_at)) FROM advertisement_auto WHERE status = 'PAID'"
+    ).fetchone()
+    conn.commit()
+    return float(row[0]) if row and row[0] is not None else 0.0
+
+
+def release_claims(conn: psycopg.Connection, ad_ids: Iterable[str], worker_id: str) -> int:
+    """Досрочно снимает аренду этого воркера с объявлений (например, при остановке)."""
+    ids = [str(a) for a in ad_ids]
+    if not ids:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM moderation_claims WHERE ad_id = ANY(%s::text[]) AND claimed_by = %s",
+            (ids, worker_id),
+        )
+        affected = cur.rowcount or 0
+    conn.commit()
+    return int(affected)
+
+
 def group_ads(rows: Iterable[Tuple[str, str, str]]) -> Dict[str, Dict[str, object]]:
     grouped: Dict[str, Dict[str, object]] = {}
     for ad_id, description, image_url in rows:
@@ -189,21 +853,8 @@ def save_detections(conn: psycopg.Connection, run_id: int, items: List[dict]) ->
     conn.commit()
 
 
-def save_result_summary(
-        conn: psycopg.Connection,
-        run_id: int,
-        ad_id: str,
-        detections: List[dict],
-) -> int:
-    """Сохраняет агрегированный результат модерации в таблицу moderation_results.
-
-    Расчёт:
-    - text_detections: количество детекций с type == 'text'
-    - image_detections: количество детекций с type == 'image'
-    - acceptable = (text_detections == 0 and image_detections == 0)
-    - text_summary: JSON по категориям с уникальными values
-    - image_summary: JSON по категориям с перечнем изображений/ключей
-    """
+def _summarize_detections(detections: List[dict]) -> Dict[str, object]:
+    """Агрегаты по детекциям для таблицы moderation_results (см. save_result_summary)."""
     text_count = 0
     image_count = 0
 
@@ -237,6 +888,35 @@ def save_result_summary(
     text_acceptable = (text_count == 0)
     image_acceptable = (image_count == 0)
 
+    return {
+        "acceptable": acceptable,
+        "text_acceptable": text_acceptable,
+        "image_acceptable": image_acceptable,
+        "total_detections": int(text_count + image_count),
+        "text_detections": int(text_count),
+        "image_detections": int(image_count),
+        "text_summary": text_summary,
+        "image_summary": image_summary,
+    }
+
+
+def save_result_summary(
+        conn: psycopg.Connection,
+        run_id: int,
+        ad_id: str,
+        detections: List[dict],
+) -> int:
+    """Сохраняет агрегированный результат модерации в таблицу moderation_results.
+
+    Расчёт:
+    - text_detections: количество детекций с type == 'text'
+    - image_detections: количество детекций с type == 'image'
+    - acceptable = (text_detections == 0 and image_detections == 0)
+    - text_summary: JSON по категориям с уникальными values
+    - image_summary: JSON по категориям с перечнем изображений/ключей
+    """
+    summary = _summarize_detections(detections)
+
     with conn.cursor() as cur:
         cur.execute(
             """
@@ -249,14 +929,14 @@ def save_result_summary(
             (
                 str(ad_id),
                 run_id,
-                acceptable,
-                text_acceptable,
-                image_acceptable,
-                int(text_count + image_count),
-                int(text_count),
-                int(image_count),
-                json.dumps(text_summary, ensure_ascii=False),
-                json.dumps(image_summary, ensure_ascii=False),
+                summary["acceptable"],
+                summary["text_acceptable"],
+                summary["image_acceptable"],
+                summary["total_detections"],
+                summary["text_detections"],
+                summary["image_detections"],
+                json.dumps(summary["text_summary"], ensure_ascii=False),
+                json.dumps(summary["image_summary"], ensure_ascii=False),
             ),
         )
         res_id = cur.fetchone()[0]
@@ -305,3 +985,402 @@ def commit_ad_rejected(conn: psycopg.Connection, ad_id: str) -> int:
         affected = cur.rowcount or 0
     conn.commit()
     return int(affected)
+
+
+# Весь результат по объявлению одним data-modifying CTE: прогон, детекции, сводка,
+# замена изображений и смена статуса уходят на сервер одним запросом.
+_SAVE_AD_RESULT_SQL = """
+WITH run AS (
+    INSERT INTO moderation_runs(acceptable, source_id, verdict_json, content_fingerprint, text_fingerprint)
+    VALUES (%(acceptable)s, %(source_id)s::text, %(verdict_json)s::jsonb,
+            %(content_fingerprint)s::text, %(text_fingerprint)s::text)
+    RETURNING id
+),
+det AS (
+    INSERT INTO moderation_detections(run_id, type, category, value, image_path, object_key)
+    SELECT run.id, d.type, d.category, d.value, d.image, d.object_key
+    FROM run,
+         jsonb_to_recordset(%(detections)s::jsonb)
+             AS d(type TEXT, category TEXT, value TEXT, image TEXT, object_key TEXT)
+),
+res AS (
+    INSERT INTO moderation_results (ad_id, run_id, acceptable, text_acceptable, image_acceptable,
+                                    total_detections, text_detections, image_detections,
+                                    text_summary, image_summary)
+    SELECT %(source_id)s::text, run.id, %(acceptable)s, %(text_acceptable)s, %(image_acceptable)s,
+           %(total_detections)s, %(text_detections)s, %(image_detections)s,
+           %(text_summary)s::jsonb, %(image_summary)s::jsonb
+    FROM run
+),
+img_del AS (
+    DELETE
+    FROM public.advertisement_images
+    WHERE %(replace_images)s
+      AND advertisement_id = %(ad_id)s
+),
+img_ins AS (
+    INSERT INTO public.advertisement_images(advertisement_id, image_url)
+    SELECT au.id, u.url
+    FROM advertisement_auto au,
+         unnest(%(image_urls)s::text[]) AS u(url)
+    WHERE %(replace_images)s
+      AND au.id = %(ad_id)s
+),
+clm AS (
+    DELETE
+    FROM moderation_claims
+    WHERE %(update_status)s
+      AND ad_id = %(source_id)s::text
+      AND claimed_by = %(worker_id)s::text
+),
+upd AS (
+    UPDATE advertisement_auto
+    SET status       = %(status)s,
+        moderated_at = NOW()
+    WHERE %(update_status)s
+      AND id = %(ad_id)s
+      AND status = 'PAID'
+    RETURNING 1
+)
+SELECT (SELECT id FROM run), (SELECT count(*) FROM upd)
+"""
+
+
+def _ad_result_params(
+        ad_id: str,
+        verdict: dict,
+        image_urls: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        worker_id: str = "",
+) -> Dict[str, object]:
+    detections = verdict.get("detections") or []
+    summary = _summarize_detections(detections)
+    det_rows = [
+        {
+            "type": d.get("type"),
+            "category": d.get("category"),
+            "value": d.get("value"),
+            "image": d.get("image"),
+            "object_key": d.get("object_key"),
+        }
+        for d in detections
+    ]
+    return {
+        # source_id — текстовый ключ для наших таблиц, ad_id сравнивается с id объявления
+        # в его родном типе; параметры разделены, чтобы PostgreSQL не вывел для них один тип
+        "source_id": str(ad_id),
+        "ad_id": str(ad_id),
+        "acceptable": bool(verdict.get("acceptable")),
+        "verdict_json": json.dumps(verdict, ensure_ascii=False),
+        "content_fingerprint": verdict.get("content_fingerprint"),
+        "text_fingerprint": verdict.get("text_fingerprint"),
+        "detections": json.dumps(det_rows, ensure_ascii=False),
+        "text_acceptable": summary["text_acceptable"],
+        "image_acceptable": summary["image_acceptable"],
+        "total_detections": summary["total_detections"],
+        "text_detections": summary["text_detections"],
+        "image_detections": summary["image_detections"],
+        "text_summary": json.dumps(summary["text_summary"], ensure_ascii=False),
+        "image_summary": json.dumps(summary["image_summary"], ensure_ascii=False),
+        "replace_images": bool(image_urls),
+        "image_urls": list(image_urls or []),
+        "update_status": status is not None,
+        "status": status or "PAID",
+        "worker_id": worker_id,
+    }
+
+
+def save_ad_result(
+        conn: psycopg.Connection,
+        ad_id: str,
+        verdict: dict,
+        image_urls: Optional[List[str]] = None,
+        status: Optional[str] = None,
+        commit: bool = True,
+        worker_id: str = "",
+) -> Tuple[int, int]:
+    """Атомарно сохраняет результат модерации объявления одним запросом.
+
+    Пишет moderation_runs, moderation_detections и moderation_results,
+    при непустом image_urls заменяет advertisement_images, при заданном
+    status (MODERATED/REJECTED) переводит объявление из PAID в этот статус
+    и снимает аренду объявления (moderation_claims). Без status объявление
+    остаётся PAID, и аренда держится до истечения: иначе его сразу захватил
+    бы следующий проход. Снимается только аренда воркера worker_id: если наша
+    истекла и объявление уже захватил другой воркер, его аренда остаётся.
+    При commit=False коммит остаётся за вызывающим (см. save_ad_results).
+
+    Возвращает (run_id, число обновлённых строк advertisement_auto).
+    """
+    params = _ad_result_params(ad_id, verdict, image_urls, status, worker_id)
+    with conn.cursor() as cur:
+        cur.execute(_SAVE_AD_RESULT_SQL, params)
+        run_id, updated = cur.fetchone()
+    if commit:
+        conn.commit()
+    return int(run_id), int(updated or 0)
+
+
+def save_ad_results(
+        conn: psycopg.Connection,
+        items: Iterable[Tuple[str, dict, Optional[List[str]], Optional[str]]],
+        worker_id: str = "",
+) -> List[Tuple[int, int]]:
+    """Сохраняет результаты нескольких объявлений в одной транзакции с одним коммитом.
+
+    items — кортежи (ad_id, verdict, image_urls, status), как у save_ad_result.
+    При ошибке транзакция откатывается целиком и исключение пробрасывается.
+    """
+    out: List[Tuple[int, int]] = []
+    try:
+        for ad_id, verdict, image_urls, status in items:
+            out.append(save_ad_result(conn, ad_id, verdict, image_urls, status, commit=False, worker_id=worker_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return out
+
+
+def _column_type(conn: psycopg.Connection, table: str, column: str) -> sql.Composable:
+    """SQL-тип колонки: значения передаются массивом text[] и приводятся к нему (id, статус-enum)."""
+    row = conn.execute(
+        """
+        SELECT format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass
+          AND a.attname = %s
+        """,
+        (table, column),
+    ).fetchone()
+    return sql.SQL(row[0] if row else "text")
+
+
+def save_ad_results_bulk(
+        conn: psycopg.Connection,
+        items: Iterable[Tuple[str, dict, Optional[List[str]], Optional[str]]],
+        worker_id: str = "",
+) -> List[Tuple[int, int]]:
+    """Сохраняет результаты многих объявлений через COPY в одной транзакции.
+
+    То же, что save_ad_results, но без запроса на каждое объявление: id запусков
+    резервируются одним запросом к последовательности moderation_runs,
+    moderation_runs, moderation_detections и moderation_results заполняются
+    через COPY, а замена изображений, снятие аренды и смена статуса выполняются
+    по одному запросу на всю пачку (массивы через unnest).
+    При ошибке транзакция откатывается целиком и исключение пробрасывается.
+
+    Возвращает [(run_id, число обновлённых строк advertisement_auto)] в порядке items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT nextval(pg_get_serial_sequence('moderation_runs', 'id')) FROM generate_series(1, %s)",
+                (len(items),),
+            )
+            run_ids = [int(r[0]) for r in cur.fetchall()]
+
+            with cur.copy(
+                """
+                COPY moderation_runs (id, acceptable, source_id, verdict_json,
+                                      content_fingerprint, text_fingerprint) FROM STDIN
+                """
+            ) as copy:
+                for run_id, (ad_id, verdict, _, _) in zip(run_ids, items):
+                    copy.write_row((
+                        run_id, bool(verdict.get("acceptable")), str(ad_id), json.dumps(verdict, ensure_ascii=False),
+                        verdict.get("content_fingerprint"), verdict.get("text_fingerprint"),
+                    ))
+
+            with cur.copy(
+                "COPY moderation_detections (run_id, type, category, value, image_path, object_key) FROM STDIN"
+            ) as copy:
+                for run_id, (_, verdict, _, _) in zip(run_ids, items):
+                    for d in verdict.get("detections") or []:
+                        copy.write_row(
+                            (run_id, d.get("type"), d.get("category"), d.get("value"), d.get("image"), d.get("object_key"))
+                        )
+
+            with cur.copy(
+                """
+                COPY moderation_results (ad_id, run_id, acceptable, text_acceptable, image_acceptable,
+                                         total_detections, text_detections, image_detections,
+                                         text_summary, image_summary) FROM STDIN
+                """
+            ) as copy:
+                for run_id, (ad_id, verdict, _, _) in zip(run_ids, items):
+                    summary = _summarize_detections(verdict.get("detections") or [])
+                    copy.write_row((
+                        str(ad_id), run_id, bool(verdict.get("acceptable")),
+                        summary["text_acceptable"], summary["image_acceptable"],
+                        summary["total_detections"], summary["text_detections"], summary["image_detections"],
+                        json.dumps(summary["text_summary"], ensure_ascii=False),
+                        json.dumps(summary["image_summary"], ensure_ascii=False),
+                    ))
+
+            id_type = _column_type(conn, "advertisement_auto", "id")
+            ad_ids = [str(ad_id) for ad_id, _, _, _ in items]
+
+            replaced = [(str(ad_id), urls) for ad_id, _, urls, _ in items if urls]
+            if replaced:
+                cur.execute(
+                    sql.SQL(
+                        "DELETE FROM public.advertisement_images WHERE advertisement_id = ANY(%s::{}[])"
+                    ).format(id_type),
+                    ([ad_id for ad_id, _ in replaced],),
+                )
+                pairs = [(ad_id, url) for ad_id, urls in replaced for url in urls]
+                cur.execute(
+                    sql.SQL(
+                        """
+                        INSERT INTO public.advertisement_images(advertisement_id, image_url)
+                        SELECT au.id, u.url
+                        FROM unnest(%s::text[], %s::text[]) AS u(ad_id, url)
+                                 JOIN advertisement_auto au ON au.id = u.ad_id::{}
+                        """
+                    ).format(id_type),
+                    ([a for a, _ in pairs], [u for _, u in pairs]),
+                )
+
+            updated_ids = set()
+            with_status = [(str(ad_id), status) for ad_id, _, _, status in items if status is not None]
+            if with_status:
+                # Аренду снимаем только у объявлений, которые уходят из PAID (см. save_ad_result)
+                cur.execute(
+                    "DELETE FROM moderation_claims WHERE ad_id = ANY(%s::text[]) AND claimed_by = %s",
+                    ([a for a, _ in with_status], worker_id),
+                )
+                cur.execute(
+                    sql.SQL(
+                        """
+                        UPDATE advertisement_auto au
+                        SET status       = u.status::{},
+                            moderated_at = NOW()
+                        FROM unnest(%s::text[], %s::text[]) AS u(ad_id, status)
+                        WHERE au.id = u.ad_id::{}
+                          AND au.status = 'PAID'
+                        RETURNING au.id::text
+                        """
+                    ).format(_column_type(conn, "advertisement_auto", "status"), id_type),
+                    ([a for a, _ in with_status], [st for _, st in with_status]),
+                )
+                updated_ids = {r[0] for r in cur.fetchall()}
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [(run_id, 1 if ad_id in updated_ids else 0) for run_id, ad_id in zip(run_ids, ad_ids)]
+
+
+class PgImageCacheStore:
+    """Постоянное хранилище кэша детекций (таблица image_detection_cache).
+
+    Соединения берутся из пула на каждый вызов, поэтому хранилище можно
+    использовать из нескольких потоков конвейера. Видны только записи,
+    сделанные тем же детектором (detector — см. image_moderator.detector_identity):
+    после смены модели или её параметров старые боксы не отдаются.
+    """
+
+    def __init__(self, pool: ConnectionPool, detector: str = ""):
+        self.pool = pool
+        self.detector = detector
+
+    @staticmethod
+    def _entry(row):
+        from .image_moderator.detection_cache import CachedDetection
+
+        content_hash_, phash, boxes, object_key = row
+        return CachedDetection(
+            content_hash=content_hash_,
+            boxes=[tuple(int(v) for v in b) for b in (boxes or [])],
+            object_key=object_key,
+            phash=phash,
+        )
+
+    def get(self, content_hash: str):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT content_hash, phash, boxes, object_key
+                FROM image_detection_cache
+                WHERE content_hash = %s
+                  AND detector = %s
+                """,
+                (content_hash, self.detector),
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def get_by_phash(self, phash: str):
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT content_hash, phash, boxes, object_key
+                FROM image_detection_cache
+                WHERE phash = %s
+                  AND detector = %s
+                ORDER BY (object_key IS NOT NULL) DESC, created_at DESC
+                LIMIT 1
+                """,
+                (phash, self.detector),
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def put(self, entry) -> None:
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO image_detection_cache (content_hash, phash, boxes, object_key, detector)
+                VALUES (%s, %s, %s::jsonb, %s, %s)
+                ON CONFLICT (content_hash) DO UPDATE
+                    SET phash      = COALESCE(EXCLUDED.phash, image_detection_cache.phash),
+                        boxes      = EXCLUDED.boxes,
+                        -- Объект, покрытый по боксам другого детектора, не переносим
+                        object_key = CASE
+                                         WHEN image_detection_cache.detector = EXCLUDED.detector
+                                             THEN COALESCE(EXCLUDED.object_key, image_detection_cache.object_key)
+                                         ELSE EXCLUDED.object_key
+                            END,
+                        detector   = EXCLUDED.detector,
+                        created_at = NOW()
+                """,
+                (
+                    entry.content_hash, entry.phash, json.dumps([list(b) for b in entry.boxes]),
+                    entry.object_key, self.detector,
+                ),
+            )
+
+    def set_object_key(self, content_hash: str, object_key: str) -> None:
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE image_detection_cache SET object_key = %s WHERE content_hash = %s AND detector = %s",
+                (object_key, content_hash, self.detector),
+            )
+
+
+class PgTextCacheStore:
+    """Постоянное хранилище кэша текстовой модерации (таблица text_moderation_cache)."""
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                "SELECT detections FROM text_moderation_cache WHERE cache_key = %s",
+                (key,),
+            ).fetchone()
+        return list(row[0] or []) if row else None
+
+    def put(self, key: str, detections: List[dict]) -> None:
+        with self.pool.connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO text_moderation_cache (cache_key, detections)
+                VALUES (%s, %s::jsonb)
+                ON CONFLICT (cache_key) DO UPDATE SET detections = EXCLUDED.detections
+                """,
+                (key, json.dumps(detections, ensure_ascii=False)),
+            )
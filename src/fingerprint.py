@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import hashlib
+from typing import Iterable
+
+
+def _sha256(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def normalize_description(text: str) -> str:
+    # Та же нормализация, что у текстовой модерации: различия в пробелах не меняют вердикт
+    return " ".join((text or "").split())
+
+
+def text_fingerprint(description: str, salt: str = "") -> str:
+    """Отпечаток описания объявления; salt — версия правил/моделей модерации."""
+    return _sha256(f"{salt}\x00{normalize_description(description)}")
+
+
+def content_fingerprint(description: str, image_urls: Iterable[str], salt: str = "") -> str:
+    """Отпечаток объявления целиком: описание и набор ссылок на изображения.
+
+    Ссылки хэшируются по отдельности и сортируются, поэтому порядок фото
+    на отпечаток не влияет.
+    """
+    url_hashes = sorted(_sha256(str(u).strip()) for u in image_urls if u)
+    return _sha256(text_fingerprint(description, salt) + "\x00" + "\n".join(url_hashes))
+
+
+__all__ = ["content_fingerprint", "normalize_description", "text_fingerprint"]
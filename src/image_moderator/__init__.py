@@ -1,3 +1,24 @@
-from .image_moderator import moderate_images
+from .image_moderator import (
+    moderate_images,
+    moderate_image_buffers,
+    detect_boxes,
+    get_model,
+    warmup_model,
+    configure_detector,
+)
+from .detection_cache import DetectionCache
+from .onnx_detector import OnnxPlateDetector, quantize_model
+from .workers import ImageWorkerPool
 
-__all__ = ["moderate_images"]
\ No newline at end of file
+__all__ = [
+    "moderate_images",
+    "moderate_image_buffers",
+    "DetectionCache",
+    "OnnxPlateDetector",
+    "ImageWorkerPool",
+    "quantize_model",
+    "detect_boxes",
+    "get_model",
+    "warmup_model",
+    "configure_detector",
+]
@@ -0,0 +1,174 @@
+"""Сравнение вариантов детектора номеров по скорости и полноте.
+
+Эталон — детекции базовой модели (по умолчанию текущая конфигурация:
+ultralytics, без квантования, 640). Для каждого варианта считаются задержка
+на изображение и recall/precision относительно эталона: бокс варианта
+засчитывается, если его IoU с эталонным боксом не меньше --match-iou.
+
+Запуск из корня репозитория:
+
+    python -m src.image_moderator.benchmark \\
+        --model src/image_moderator/models/license-plate-finetune-v1l.onnx \\
+        --variants onnxruntime:none:640,onnxruntime:dynamic:640,onnxruntime:static:640,onnxruntime:none:480
+
+Вариант задаётся как backend:quantize:imgsz. Меньший imgsz для ONNX имеет
+смысл только для экспорта с динамическим входом (или отдельного экспорта
+с нужным размером, переданного через --model). Static-квантование калибруется
+по тем же изображениям из example/, поэтому на них его точность немного завышена.
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from .image_moderator import EXAMPLE_DIR, DetectorOptions, build_detector, calibration_images, make_detector_options
+
+Box = Tuple[int, int, int, int]
+
+DEFAULT_BASELINE = "ultralytics:none:640"
+DEFAULT_VARIANTS = (
+    "onnxruntime:none:640,"
+    "onnxruntime:dynamic:640,"
+    "onnxruntime:static:640,"
+    "onnxruntime:none:480,"
+    "onnxruntime:dynamic:480"
+)
+
+
+def parse_variant(spec: str, conf: float = 0.25, iou: float = 0.7, threads: int = 0) -> DetectorOptions:
+    parts = [p.strip() for p in spec.split(":")]
+    if len(parts) != 3:
+        raise ValueError(f"Variant must look like backend:quantize:imgsz, got: {spec}")
+    backend, quantize, imgsz = parts
+    return make_detector_options(
+        backend, conf, iou, intra_op_threads=threads, quantize=quantize, imgsz=int(imgsz)
+    )
+
+
+def _iou(a: Box, b: Box) -> float:
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_boxes(reference: Sequence[Box], predicted: Sequence[Box], min_iou: float = 0.5) -> int:
+    """Число совпавших пар при жадном сопоставлении по убыванию IoU (каждый бокс — не более одного раза)."""
+    pairs = sorted(
+        ((_iou(r, p), i, j) for i, r in enumerate(reference) for j, p in enumerate(predicted)),
+        reverse=True,
+    )
+    used_ref, used_pred = set(), set()
+    for value, i, j in pairs:
+        if value < min_iou:
+            break
+        if i in used_ref or j in used_pred:
+            continue
+        used_ref.add(i)
+        used_pred.add(j)
+    return len(used_ref)
+
+
+def run_variant(model_path: str, options: DetectorOptions, images: List[np.ndarray], repeat: int = 3) -> Dict:
+    """Загружает вариант, прогревает его и замеряет задержку по одному изображению за вызов."""
+    started = time.perf_counter()
+    detector = build_detector(model_path, options)
+    load_sec = time.perf_counter() - started
+
+    detector.detect([images[0]])
+
+    latencies = []
+    boxes: List[List[Box]] = []
+    for run in range(max(1, repeat)):
+        for img in images:
+            t0 = time.perf_counter()
+            result = detector.detect([img])[0]
+            latencies.append(time.perf_counter() - t0)
+            if run == 0:
+                boxes.append([tuple(int(v) for v in b) for b in result])
+
+    lat = np.asarray(latencies) * 1000.0
+    return {
+        "load_sec": round(load_sec, 3),
+        "input": [getattr(detector, "height", options.imgsz), getattr(detector, "width", options.imgsz)],
+        "latency_ms_mean": round(float(lat.mean()), 2),
+        "latency_ms_p50": round(float(np.percentile(lat, 50)), 2),
+        "latency_ms_p95": round(float(np.percentile(lat, 95)), 2),
+        "boxes": boxes,
+    }
+
+
+def compare(reference: List[List[Box]], predicted: List[List[Box]], min_iou: float = 0.5) -> Dict:
+    total_ref = sum(len(r) for r in reference)
+    total_pred = sum(len(p) for p in predicted)
+    matched = sum(match_boxes(r, p, min_iou) for r, p in zip(reference, predicted))
+    return {
+        "reference_boxes": total_ref,
+        "predicted_boxes": total_pred,
+        "matched": matched,
+        "recall": round(matched / total_ref, 4) if total_ref else 1.0,
+        "precision": round(matched / total_pred, 4) if total_pred else 1.0,
+    }
+
+
+def _label(options: DetectorOptions) -> str:
+    return f"{options.backend}:{options.quantize}:{options.imgsz}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Latency/recall benchmark of plate detector variants")
+    parser.add_argument("--model", required=True, help="Путь к базовой модели (.onnx или .pt)")
+    parser.add_argument("--images", default=EXAMPLE_DIR, help="Каталог с изображениями (по умолчанию example/)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Эталон: backend:quantize:imgsz")
+    parser.add_argument("--variants", default=DEFAULT_VARIANTS, help="Варианты через запятую")
+    parser.add_argument("--repeat", type=int, default=3, help="Сколько раз прогнать набор для замера задержки")
+    parser.add_argument("--match-iou", type=float, default=0.5, help="Минимальный IoU для совпадения боксов")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.7)
+    parser.add_argument("--threads", type=int, default=0, help="intra_op потоки onnxruntime (0 — по умолчанию)")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args(argv)
+
+    paths = calibration_images(args.images)
+    images = [img for img in (cv2.imread(p) for p in paths) if img is not None]
+    if not images:
+        parser.error(f"No images found in {args.images}")
+
+    baseline = parse_variant(args.baseline, args.conf, args.iou, args.threads)
+    variants = [parse_variant(v, args.conf, args.iou, args.threads) for v in args.variants.split(",") if v.strip()]
+
+    print(f"[BENCH] {len(images)} images, baseline {_label(baseline)}")
+    reference = run_variant(args.model, baseline, images, args.repeat)
+    results = [{"variant": _label(baseline), **reference, **compare(reference["boxes"], reference["boxes"], args.match_iou)}]
+
+    for options in variants:
+        try:
+            res = run_variant(args.model, options, images, args.repeat)
+        except Exception as e:
+            print(f"[BENCH][SKIP] {_label(options)}: {e}")
+            continue
+        results.append({"variant": _label(options), **res, **compare(reference["boxes"], res["boxes"], args.match_iou)})
+
+    header = f"{'variant':<28} {'input':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'recall':>7} {'prec':>7} {'boxes':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        size = "x".join(str(v) for v in r["input"])
+        print(
+            f"{r['variant']:<28} {size:>9} {r['latency_ms_mean']:>9.2f} {r['latency_ms_p50']:>9.2f} "
+            f"{r['latency_ms_p95']:>9.2f} {r['recall']:>7.3f} {r['precision']:>7.3f} {r['predicted_boxes']:>6}"
+        )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ..cache import LruCache
+
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class CachedDetection:
+    """Результат детекции для одного содержимого изображения.
+
+    object_key — ключ уже загруженного покрытого изображения; None, если
+    номеров нет или покрытое изображение ещё не загружено.
+    """
+
+    content_hash: str
+    boxes: List[Box] = field(default_factory=list)
+    object_key: Optional[str] = None
+    phash: Optional[str] = None
+
+    @property
+    def reusable(self) -> bool:
+        # Без номеров переиспользуем всегда; с номерами — только если есть готовый объект
+        return not self.boxes or bool(self.object_key)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(image: np.ndarray) -> str:
+    """64-битный dHash: устойчив к перекодированию JPEG и изменению размера."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+class DetectionCache:
+    """Кэш детекций номеров по хэшу содержимого изображения.
+
+    Первый уровень — LRU в памяти процесса, второй (опционально) — постоянное
+    хранилище store с методами get(content_hash), get_by_phash(phash), put(entry)
+    и set_object_key(content_hash, object_key) (см. db.PgImageCacheStore).
+    Ошибки хранилища не прерывают модерацию: кэш работает по принципу best effort.
+
+    Записи действительны только для одного детектора: кэш создаётся под
+    текущую конфигурацию (store фильтрует по ней, см. db.PgImageCacheStore).
+    Перцептивный хэш хранится рядом с результатом, но совпадение по нему
+    приблизительное: get_by_phash служит только для сверки, а записи под
+    content_hash создаются исключительно по результату детекции.
+    """
+
+    def __init__(self, max_entries: int = 10000, store=None, use_phash: bool = False):
+        self._lru: LruCache[str, CachedDetection] = LruCache(max_entries)
+        self._phash_index: LruCache[str, str] = LruCache(max_entries)
+        self.store = store
+        self.use_phash = use_phash
+        self._logger = logging.getLogger(__name__)
+
+    def get(self, digest: str) -> Optional[CachedDetection]:
+        entry = self._lru.get(digest)
+        if entry is None and self.store is not None:
+            entry = self._store_call("get", digest)
+            if entry is not None:
+                self._remember(entry)
+        return entry
+
+    def get_by_phash(self, phash: str) -> Optional[CachedDetection]:
+        digest = self._phash_index.get(phash)
+        if digest is not None:
+            entry = self._lru.get(digest)
+            if entry is not None:
+                return entry
+        if self.store is not None:
+            entry = self._store_call("get_by_phash", phash)
+            if entry is not None:
+                self._remember(entry)
+            return entry
+        return None
+
+    def put(self, entry: CachedDetection) -> None:
+        self._remember(entry)
+        if self.store is not None:
+            self._store_call("put", entry)
+
+    def set_object_key(self, digest: str, object_key: str) -> None:
+        """Привязывает загруженный покрытый объект к записи после успешной загрузки."""
+        entry = self._lru.get(digest)
+        if entry is not None:
+            entry.object_key = object_key
+        if self.store is not None:
+            self._store_call("set_object_key", digest, object_key)
+
+    def _remember(self, entry: CachedDetection) -> None:
+        self._lru.put(entry.content_hash, entry)
+        if entry.phash:
+            self._phash_index.put(entry.phash, entry.content_hash)
+
+    def _store_call(self, method: str, *args):
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            self._logger.warning("[CACHE][IMAGE][ERROR] %s failed: %s", method, e)
+            return None
+
+
+__all__ = ["CachedDetection", "DetectionCache", "content_hash", "perceptual_hash"]
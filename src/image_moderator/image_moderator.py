@@ -1,115 +1,639 @@
+import glob
+import logging
 import os
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
 import cv2
-from ultralytics import YOLO
 import numpy as np
-import cv2
 
-import os
-import cv2
-from ultralytics import YOLO
+from ..metrics import COVER_SECONDS, IMAGE_DECODE_SECONDS, IMAGE_ENCODE_SECONDS, INFERENCE_SECONDS
+from .detection_cache import CachedDetection, content_hash, perceptual_hash
+from .onnx_detector import QUANTIZE_MODES, OnnxPlateDetector, quantize_model
 
+# Изображения для калибровки static-квантования по умолчанию
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example")
 
-def moderate_images(image_paths, model_path, output_dir, ad_id):
-    model = YOLO(model_path)
-    detections = []
 
-    for image_path in image_paths:
-        image = cv2.imread(image_path)
-        if image is None:
+# ---------- Настройки детектора ----------
+@dataclass(frozen=True)
+class DetectorOptions:
+    # ultralytics | onnxruntime
+    backend: str = "ultralytics"
+    conf: float = 0.25
+    iou: float = 0.7
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    # none | dynamic | static (int8-вариант ONNX-модели, см. onnx_detector.quantize_model)
+    quantize: str = "none"
+    # Сторона входа модели; для ONNX с фиксированным входом берётся размер из модели
+    imgsz: int = 640
+    # Каталог калибровочных изображений для static (пусто — example/)
+    calibration_dir: str = ""
+
+
+_options = DetectorOptions()
+
+# Уменьшенное декодирование для детекции: 0 — авто по imgsz, 1 — выключено, 2/4/8 — фиксированный делитель
+_decode_reduction = 0
+
+
+def configure_detector(
+    backend: str = "ultralytics",
+    conf: float = 0.25,
+    iou: float = 0.7,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    quantize: str = "none",
+    imgsz: int = 640,
+    calibration_dir: str = "",
+    decode_reduction: int = 0,
+) -> None:
+    """Выбор бэкенда детектора и его параметров для последующих get_model()."""
+    global _options, _decode_reduction
+    _options = make_detector_options(
+        backend, conf, iou, intra_op_threads, inter_op_threads, quantize, imgsz, calibration_dir
+    )
+    decode_reduction = int(decode_reduction)
+    if decode_reduction not in _REDUCED_FLAGS and decode_reduction not in (0, 1):
+        raise ValueError(f"Unsupported decode reduction: {decode_reduction}")
+    _decode_reduction = decode_reduction
+
+
+def make_detector_options(
+    backend: str = "ultralytics",
+    conf: float = 0.25,
+    iou: float = 0.7,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+    quantize: str = "none",
+    imgsz: int = 640,
+    calibration_dir: str = "",
+) -> DetectorOptions:
+    backend = str(backend or "ultralytics").strip().lower()
+    if backend not in {"ultralytics", "onnxruntime"}:
+        raise ValueError(f"Unknown detector backend: {backend}")
+    quantize = str(quantize or "none").strip().lower()
+    if quantize not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown detector quantization: {quantize}")
+    # YOLO требует сторону, кратную шагу 32
+    imgsz = max(32, int(imgsz) // 32 * 32)
+    return DetectorOptions(
+        backend, float(conf), float(iou), int(intra_op_threads), int(inter_op_threads),
+        quantize, imgsz, str(calibration_dir or ""),
+    )
+
+
+def detector_identity(model_path: str) -> str:
+    """Идентичность текущего детектора: файл модели (имя и mtime) и параметры, от которых зависят боксы."""
+    try:
+        mtime = f"{os.path.getmtime(model_path):.0f}"
+    except OSError:
+        mtime = ""
+    o = _options
+    return (
+        f"{os.path.basename(model_path)}@{mtime}|{o.backend}|{o.quantize}|{o.imgsz}"
+        f"|{o.conf:g}|{o.iou:g}|r{_decode_reduction}"
+    )
+
+
+def calibration_images(directory: str = "") -> List[str]:
+    """Изображения (jpg/jpeg/png) из directory и его подкаталогов, по умолчанию — example/."""
+    directory = directory or EXAMPLE_DIR
+    paths = []
+    for pattern in ("*.jpg", "*.jpeg", "*.png"):
+        paths.extend(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+    return sorted(paths)
+
+
+class _UltralyticsDetector:
+    """Обёртка над ultralytics.YOLO с тем же интерфейсом detect(), что у OnnxPlateDetector."""
+
+    def __init__(self, model_path: str, options: DetectorOptions):
+        # Импорт тянет torch, поэтому делаем его только для этого бэкенда
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.options = options
+        # Предиктор ultralytics не рассчитан на параллельные вызовы из нескольких потоков
+        self._lock = threading.Lock()
+
+    def detect(self, images):
+        with self._lock:
+            # ultralytics возвращает по одному Results на каждый элемент source, порядок сохраняется
+            results = self.model.predict(
+                source=list(images), conf=self.options.conf, iou=self.options.iou, imgsz=self.options.imgsz
+            )
+        return [[tuple(map(int, box)) for box in result.boxes.xyxy] for result in results]
+
+
+# ---------- Реестр моделей ----------
+# Модель загружается один раз на процесс и переиспользуется всеми объявлениями.
+# Ключ — (абсолютный путь, mtime файла, настройки): если файл модели подменили, загрузится новая версия.
+_MODELS: Dict[Tuple[str, float, DetectorOptions], object] = {}
+_MODELS_LOCK = threading.Lock()
+
+# Размер пачки изображений на один вызов детектора
+DEFAULT_BATCH_SIZE = 8
+
+
+def _model_key(model_path: str) -> Tuple[str, float, DetectorOptions]:
+    path = os.path.abspath(model_path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = 0.0
+    return path, mtime, _options
+
+
+def build_detector(model_path: str, options: DetectorOptions):
+    """Создаёт детектор с заданными настройками без участия реестра моделей."""
+    path = model_path
+    if options.quantize != "none":
+        path = quantize_model(
+            model_path, options.quantize, calibration_images(options.calibration_dir), options.imgsz
+        )
+    if options.backend == "onnxruntime":
+        return OnnxPlateDetector(
+            path,
+            conf=options.conf,
+            iou=options.iou,
+            intra_op_threads=options.intra_op_threads,
+            inter_op_threads=options.inter_op_threads,
+            imgsz=options.imgsz,
+        )
+    return _UltralyticsDetector(path, options)
+
+
+def get_model(model_path: str):
+    """Возвращает закэшированный детектор для model_path, загружая его при первом обращении.
+
+    У детектора есть метод detect(images) -> [[(x1, y1, x2, y2), ...], ...].
+    """
+    key = _model_key(model_path)
+    model = _MODELS.get(key)
+    if model is not None:
+        return model
+    with _MODELS_LOCK:
+        model = _MODELS.get(key)
+        if model is None:
+            # Выкидываем устаревшие версии той же модели
+            for old_key in [k for k in _MODELS if k[0] == key[0]]:
+                del _MODELS[old_key]
+            model = build_detector(model_path, key[2])
+            _MODELS[key] = model
+    return model
+
+
+def warmup_model(model_path: str, imgsz: Optional[int] = None) -> None:
+    """Загрузка модели и прогон холостого инференса при старте планировщика.
+
+    Первое обращение к ONNX-сессии заметно дороже последующих, поэтому
+    платим эту цену заранее, а не на первом объявлении.
+    """
+    model = get_model(model_path)
+    imgsz = imgsz or _options.imgsz
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    model.detect([dummy])
+
+
+def detect_boxes(images, model_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Пакетный инференс детектора по уже декодированным изображениям.
+
+    images — список массивов BGR (одного объявления или нескольких сразу).
+    Изображения прогоняются через модель пачками по batch_size.
+    Возвращает список боксов [(x1, y1, x2, y2), ...] для каждого изображения
+    в том же порядке, что и на входе.
+    """
+    model = get_model(model_path)
+    batch_size = max(1, int(batch_size or 1))
+    boxes_per_image = []
+
+    for start in range(0, len(images), batch_size):
+        chunk = list(images[start:start + batch_size])
+        boxes_per_image.extend(model.detect(chunk))
+
+    return boxes_per_image
+
+
+def _load_image(data):
+    """Декодирует изображение из bytes (в памяти) или из пути к файлу."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        buf = np.frombuffer(data, dtype=np.uint8)
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    return cv2.imread(data)
+
+
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# Маркеры SOF (начало кадра) JPEG, в которых записаны размеры изображения
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(buf):
+    """(ширина, высота) из заголовка JPEG без декодирования; None — не JPEG или заголовок не найден."""
+    if buf[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(buf)
+    while i + 9 <= n:
+        if buf[i] != 0xFF:
+            i += 1
+            continue
+        marker = buf[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
             continue
+        if marker in _JPEG_SOF:
+            height = int.from_bytes(buf[i + 5:i + 7], "big")
+            width = int.from_bytes(buf[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(buf[i + 2:i + 4], "big")
+    return None
 
-        results = model.predict(source=image_path)
-        annotated = image.copy()
 
-        image_detections_count = 0
+def _reduction_for(buf, imgsz):
+    """Делитель уменьшенного декодирования, при котором длинная сторона остаётся не меньше imgsz.
 
-        for result in results:
-            for box in result.boxes.xyxy:
-                x1, y1, x2, y2 = map(int, box)
+    libjpeg масштабирует прямо при декодировании (DCT), поэтому уменьшаем только
+    JPEG; для остальных форматов OpenCV всё равно декодирует полный размер.
+    """
+    if _decode_reduction == 1:
+        return 1
+    size = _jpeg_size(buf)
+    if size is None:
+        return 1
+    if _decode_reduction:
+        return _decode_reduction
+    longest = max(size)
+    for factor in (8, 4, 2):
+        if longest // factor >= imgsz:
+            return factor
+    return 1
 
-                # 1️⃣ Красивая плашка
-                draw_rounded_box(
-                    annotated,
-                    x1, y1, x2, y2,
-                    radius=12,
-                    color=(255, 255, 255),
-                    alpha=1
-                )
 
-                # 2️⃣ Текст
-                text = "autoboyarin.ru"
-                font = cv2.FONT_HERSHEY_SIMPLEX
-                thickness = 2
-                font_scale = 1.0
-
-                max_width = max(x2 - x1 - 16, 20)
-
-                while font_scale > 0.4:
-                    (tw, th), _ = cv2.getTextSize(text, font, font_scale, thickness)
-                    if tw <= max_width:
-                        break
-                    font_scale -= 0.1
-
-                text_x = x1 + (x2 - x1 - tw) // 2
-                text_y = y1 + (y2 - y1 + th) // 2
-
-                cv2.putText(
-                    annotated,
-                    text,
-                    (text_x, text_y),
-                    font,
-                    font_scale,
-                    (20, 20, 20),  # мягкий чёрный
-                    thickness,
-                    cv2.LINE_AA
-                )
+def _scale_boxes(boxes, small_shape, full_shape):
+    """Пересчёт боксов с уменьшенной копии в координаты полного изображения (с округлением наружу)."""
+    sy = full_shape[0] / small_shape[0]
+    sx = full_shape[1] / small_shape[1]
+    h, w = full_shape[:2]
+    scaled = []
+    for x1, y1, x2, y2 in boxes:
+        scaled.append((
+            max(0, int(np.floor(x1 * sx))),
+            max(0, int(np.floor(y1 * sy))),
+            min(w, int(np.ceil(x2 * sx))),
+            min(h, int(np.ceil(y2 * sy))),
+        ))
+    return scaled
+
+
+def _decode_for_detection(data):
+    """Декодирует изображение для детекции: (массив, исходные данные или None).
+
+    Для больших JPEG возвращает уменьшенную копию и исходные bytes — полный
+    размер декодируется позже и только если на изображении нашлись номера.
+    """
+    if _decode_reduction == 1:
+        return _load_image(data), None
+    buf = _read_bytes(data)
+    factor = _reduction_for(buf, _options.imgsz)
+    if factor == 1:
+        return _load_image(buf), None
+    image = cv2.imdecode(np.frombuffer(buf, dtype=np.uint8), _REDUCED_FLAGS[factor])
+    return image, buf
+
+
+def _iter_covered(items, model_path, batch_size, precheck=None):
+    """Декодирует, детектирует и закрывает номера пачками.
+
+    items — пары (ключ, bytes или путь). Для каждого декодированного
+    изображения отдаёт (ключ, изображение с плашками, боксы); боксы могут
+    быть пустыми. precheck(ключ, изображение) -> True исключает изображение
+    из инференса (например, при попадании в кэш).
+
+    Детекция идёт по уменьшенной копии (см. _decode_for_detection); для
+    изображений без номеров отдаётся именно она, для изображений с номерами —
+    полноразмерное изображение с боксами в его координатах.
+    """
+    batch_size = max(1, int(batch_size or 1))
+    items = list(items)
+
+    for start in range(0, len(items), batch_size):
+        # Декодируем одну пачку и сразу отдаём массивы в модель (без повторного чтения с диска)
+        decoded = []
+        for key, data in items[start:start + batch_size]:
+            started = time.perf_counter()
+            image, source = _decode_for_detection(data)
+            IMAGE_DECODE_SECONDS.observe(time.perf_counter() - started)
+            if image is None:
+                continue
+            if precheck is not None and precheck(key, image):
+                continue
+            decoded.append((key, image, source))
+        if not decoded:
+            continue
 
-                detections.append({
-                    "type": "image",
-                    "category": "license_plate",
-                    "image": image_path
-                })
+        with INFERENCE_SECONDS.time():
+            boxes_per_image = detect_boxes([img for _, img, _ in decoded], model_path, batch_size)
 
-                image_detections_count += 1
+        for (key, image, source), boxes in zip(decoded, boxes_per_image):
+            if boxes:
+                started = time.perf_counter()
+                if source is not None:
+                    full = _load_image(source)
+                    if full is not None:
+                        boxes = _scale_boxes(boxes, image.shape, full.shape)
+                        image = full
+                # Массив декодирован только для нас, поэтому рисуем прямо по нему
+                for x1, y1, x2, y2 in boxes:
+                    _cover_plate(image, x1, y1, x2, y2)
+                COVER_SECONDS.observe(time.perf_counter() - started)
+            yield key, image, boxes
+
+
+def _covered_name(name):
+    filename = os.path.basename(str(name).split("?")[0]) or "image.jpg"
+    return "covered_" + filename
+
+
+def moderate_images(image_paths, model_path, output_dir, ad_id, batch_size=DEFAULT_BATCH_SIZE):
+    detections = []
+
+    for image_path, annotated, boxes in _iter_covered(
+        ((p, p) for p in image_paths), model_path, batch_size
+    ):
+        if not boxes:
+            continue
 
         # ---------- сохранение ----------
-        if image_detections_count > 0:
-            target_dir = os.path.join(output_dir, str(ad_id))
-            os.makedirs(target_dir, exist_ok=True)
+        target_dir = os.path.join(output_dir, str(ad_id))
+        os.makedirs(target_dir, exist_ok=True)
 
-            out_path = os.path.join(
-                target_dir,
-                "covered_" + os.path.basename(image_path)
-            )
+        out_path = os.path.join(target_dir, _covered_name(image_path))
 
-            cv2.imwrite(out_path, annotated)
+        cv2.imwrite(out_path, annotated)
 
-            # Проставляем output_path всем детекциям этого изображения
-            for i in range(image_detections_count):
-                detections[-(i + 1)]["output_path"] = out_path
+        for _ in boxes:
+            detections.append({
+                "type": "image",
+                "category": "license_plate",
+                "image": image_path,
+                "output_path": out_path,
+            })
 
     return detections
 
-def draw_rounded_box(img, x1, y1, x2, y2, radius=10, color=(255, 255, 255), alpha=0.85):
-    overlay = img.copy()
 
-    w = x2 - x1
-    h = y2 - y1
-    radius = min(radius, w // 2, h // 2)
+def _read_bytes(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytes(data)
+    with open(data, "rb") as f:
+        return f.read()
 
-    mask = np.zeros((h, w, 3), dtype=np.uint8)
+
+def _plate_detections(name, boxes, **extra):
+    return [
+        {
+            "type": "image",
+            "category": "license_plate",
+            "image": name,
+            "box": [int(v) for v in box],
+            **extra,
+        }
+        for box in boxes
+    ]
+
+
+def _encode_covered(name, annotated):
+    """Кодирует покрытое изображение в формат исходного файла: (output_name, bytes) или None."""
+    output_name = _covered_name(name)
+    ext = os.path.splitext(output_name)[1] or ".jpg"
+    with IMAGE_ENCODE_SECONDS.time():
+        ok, encoded = cv2.imencode(ext, annotated)
+        if not ok:
+            ok, encoded = cv2.imencode(".jpg", annotated)
+    if not ok:
+        return None
+    return output_name, encoded.tobytes()
+
+
+def cover_images(pending, model_path, batch_size=DEFAULT_BATCH_SIZE, with_phash=False):
+    """Декодирует, детектирует, закрывает номера и кодирует изображения.
+
+    pending — тройки (индекс, имя, bytes или путь). Возвращает компактные
+    результаты (индекс, боксы, phash, output_name, bytes): массивы изображений
+    наружу не отдаются, поэтому функцию можно выполнять в другом процессе.
+    Для изображений без номеров output_name и bytes равны None.
+    С with_phash для каждого изображения считается перцептивный хэш
+    (инференс при этом выполняется всегда).
+    """
+    names = {idx: name for idx, name, _ in pending}
+    phashes = {}
+
+    def _check(idx, image):
+        phashes[idx] = perceptual_hash(image)
+        return False
+
+    results = []
+    for idx, annotated, boxes in _iter_covered(
+        ((idx, data) for idx, _, data in pending), model_path, batch_size, precheck=_check if with_phash else None
+    ):
+        boxes = [tuple(int(v) for v in b) for b in boxes]
+        encoded = _encode_covered(names[idx], annotated) if boxes else None
+        output_name, payload = encoded if encoded is not None else (None, None)
+        results.append((idx, boxes, phashes.get(idx), output_name, payload))
+    return results
+
+
+def moderate_image_buffers(items, model_path, batch_size=DEFAULT_BATCH_SIZE, cache=None, pool=None, skipped=None):
+    """Модерация изображений без временных файлов.
+
+    items — пары (url или имя, bytes либо путь к файлу после сброса на диск).
+    Возвращает (detections, covered), где covered — {output_name: закодированные bytes}
+    для изображений с закрытыми номерами; в детекциях проставлен output_name.
+
+    С cache (DetectionCache) изображения, чьё содержимое уже встречалось,
+    не идут в модель: детекции берутся из кэша, а в них сразу проставлен
+    object_key ранее загруженного покрытого изображения. В детекциях новых
+    изображений проставлен content_hash — по нему после загрузки вызывается
+    cache.set_object_key.
+
+    С pool (ImageWorkerPool) декодирование, инференс и кодирование идут в
+    процессах пула; кэш по-прежнему опрашивается в текущем процессе.
+    В обоих режимах найденные боксы сохраняются и кэшируются всегда, а
+    перцептивный хэш (cache.use_phash) лишь сверяет их с похожими
+    изображениями (см. _confirm_by_phash).
+
+    В список skipped (если передан) добавляются имена изображений, которые
+    не удалось проверить (например, не декодировались).
+    """
+    items = list(items)
+    per_image = [[] for _ in items]
+    covered = {}
+    digests = [None] * len(items)
+    pending = []
+    checked = set()
+
+    for idx, (name, data) in enumerate(items):
+        if cache is not None:
+            digests[idx] = content_hash(_read_bytes(data))
+            entry = cache.get(digests[idx])
+            if entry is not None and entry.reusable:
+                per_image[idx] = _plate_detections(
+                    name, entry.boxes, object_key=entry.object_key, content_hash=entry.content_hash, cache_hit=True
+                )
+                checked.add(idx)
+                continue
+        pending.append((idx, name, data))
+
+    use_phash = cache is not None and cache.use_phash
+    if pool is not None:
+        results = pool.cover(pending, batch_size, with_phash=use_phash)
+    else:
+        results = cover_images(pending, model_path, batch_size, with_phash=use_phash)
+
+    for idx, boxes, phash, output_name, payload in results:
+        checked.add(idx)
+        name = items[idx][0]
+        if use_phash and phash:
+            _confirm_by_phash(cache, name, boxes, phash)
+        if cache is not None:
+            cache.put(CachedDetection(digests[idx], list(boxes), None, phash))
+        if not boxes or payload is None:
+            continue
+
+        covered[output_name] = payload
+
+        extra = {"output_name": output_name}
+        if digests[idx] is not None:
+            extra["content_hash"] = digests[idx]
+        per_image[idx] = _plate_detections(name, boxes, **extra)
+
+    if skipped is not None:
+        skipped.extend(name for idx, (name, _) in enumerate(items) if idx not in checked)
+    detections = [det for dets in per_image for det in dets]
+    return detections, covered
+
+
+def _confirm_by_phash(cache, name, boxes, phash):
+    """Сверяет результат детекции с похожим по перцептивному хэшу изображением из кэша.
+
+    Совпадение dHash — приблизительное (разные фото на одном фоне совпадают),
+    поэтому оно ничего не заменяет: изображение всё равно проходит детекцию,
+    а в кэш под content_hash пишется только её результат. Расхождение с
+    похожим изображением лишь логируется.
+    """
+    similar = cache.get_by_phash(phash)
+    if similar is not None and bool(similar.boxes) != bool(boxes):
+        logging.getLogger(__name__).info(
+            "[IMAGE][PHASH] %s: %d plates, similar image %s had %d",
+            name, len(boxes), similar.content_hash[:12], len(similar.boxes),
+        )
+
+
+_PLATE_TEXT = "autoboyarin.ru"
+_PLATE_FONT = cv2.FONT_HERSHEY_SIMPLEX
+_PLATE_THICKNESS = 2
+
+
+@lru_cache(maxsize=256)
+def _text_layout(max_width):
+    """Масштаб шрифта и размер надписи для ширины плашки (подбор getTextSize считается один раз на ширину)."""
+    font_scale = 1.0
+    while font_scale > 0.4:
+        (tw, th), _ = cv2.getTextSize(_PLATE_TEXT, _PLATE_FONT, font_scale, _PLATE_THICKNESS)
+        if tw <= max_width:
+            break
+        font_scale -= 0.1
+    return font_scale, tw, th
+
+
+def _cover_plate(annotated, x1, y1, x2, y2):
+    # 1️⃣ Красивая плашка
+    draw_rounded_box(
+        annotated,
+        x1, y1, x2, y2,
+        radius=12,
+        color=(255, 255, 255),
+        alpha=1
+    )
+
+    # 2️⃣ Текст
+    max_width = max(x2 - x1 - 16, 20)
+    font_scale, tw, th = _text_layout(max_width)
+
+    text_x = x1 + (x2 - x1 - tw) // 2
+    text_y = y1 + (y2 - y1 + th) // 2
+
+    cv2.putText(
+        annotated,
+        _PLATE_TEXT,
+        (text_x, text_y),
+        _PLATE_FONT,
+        font_scale,
+        (20, 20, 20),  # мягкий чёрный
+        _PLATE_THICKNESS,
+        cv2.LINE_AA
+    )
+
+
+@lru_cache(maxsize=64)
+def _disc(radius):
+    """Залитый круг радиуса radius в квадрате (2r+1) x (2r+1); кэшируется по радиусу, только для чтения."""
+    disc = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.uint8)
+    cv2.circle(disc, (radius, radius), radius, 1, -1)
+    disc = disc.astype(bool)
+    disc.setflags(write=False)
+    return disc
+
+
+def _rounded_mask(w, h, radius, color):
+    """Плашка со скруглёнными углами размера w x h.
+
+    Размеры боксов почти не повторяются, поэтому кэшируется только круг
+    для углов (по радиусу), а сама плашка собирается заново.
+    """
+    shape = np.zeros((h, w), dtype=bool)
 
     # центральные прямоугольники
-    cv2.rectangle(mask, (radius, 0), (w - radius, h), color, -1)
-    cv2.rectangle(mask, (0, radius), (w, h - radius), color, -1)
+    shape[:, radius:w - radius + 1] = True
+    shape[radius:h - radius + 1, :] = True
 
     # углы
-    cv2.circle(mask, (radius, radius), radius, color, -1)
-    cv2.circle(mask, (w - radius, radius), radius, color, -1)
-    cv2.circle(mask, (radius, h - radius), radius, color, -1)
-    cv2.circle(mask, (w - radius, h - radius), radius, color, -1)
+    disc = _disc(radius)
+    for cx, cy in ((radius, radius), (w - radius, radius), (radius, h - radius), (w - radius, h - radius)):
+        x0, y0 = cx - radius, cy - radius
+        xa, xb = max(0, x0), min(w, cx + radius + 1)
+        ya, yb = max(0, y0), min(h, cy + radius + 1)
+        shape[ya:yb, xa:xb] |= disc[ya - y0:yb - y0, xa - x0:xb - x0]
+
+    mask = np.zeros((h, w, 3), dtype=np.uint8)
+    mask[shape] = color
+    return mask
+
+
+def draw_rounded_box(img, x1, y1, x2, y2, radius=10, color=(255, 255, 255), alpha=0.85):
+    """Рисует плашку прямо в img: меняется только область бокса, копий всего изображения нет."""
+    w = x2 - x1
+    h = y2 - y1
+    if w <= 0 or h <= 0:
+        return
+    radius = min(radius, w // 2, h // 2)
 
-    roi = overlay[y1:y2, x1:x2]
-    cv2.addWeighted(mask, alpha, roi, 1 - alpha, 0, roi)
+    mask = _rounded_mask(w, h, radius, tuple(color))
 
-    img[y1:y2, x1:x2] = roi
\ No newline at end of file
+    if alpha >= 1:
+        img[y1:y2, x1:x2] = mask
+    else:
+        roi = img[y1:y2, x1:x2]
+        img[y1:y2, x1:x2] = cv2.addWeighted(mask, alpha, roi, 1 - alpha, 0)
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import os
+from typing import Iterable, List, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+Box = Tuple[int, int, int, int]
+
+# none — исходная модель; dynamic — int8-веса, активации квантуются на лету;
+# static — int8-веса и активации с диапазонами по калибровочным изображениям
+QUANTIZE_MODES = ("none", "dynamic", "static")
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """Жадный NMS; IoU с оставшимися боксами считается векторно."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        xx1 = np.maximum(x1[i], x1[rest])
+        yy1 = np.maximum(y1[i], y1[rest])
+        xx2 = np.minimum(x2[i], x2[rest])
+        yy2 = np.minimum(y2[i], y2[rest])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def letterbox(images: Sequence[np.ndarray], height: int, width: int):
+    """Приводит изображения к входу модели [N, 3, height, width] как в ultralytics.
+
+    Возвращает (тензор float32 в [0, 1], метаданные для обратного пересчёта боксов).
+    """
+    n = len(images)
+    batch = np.full((n, height, width, 3), 114, dtype=np.uint8)
+    meta = []
+    for k, img in enumerate(images):
+        h, w = img.shape[:2]
+        r = min(height / h, width / w)
+        new_w, new_h = int(round(w * r)), int(round(h * r))
+        dw, dh = (width - new_w) / 2, (height - new_h) / 2
+        left, top = int(round(dw - 0.1)), int(round(dh - 0.1))
+        resized = img if (new_w, new_h) == (w, h) else cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        batch[k, top:top + new_h, left:left + new_w] = resized
+        meta.append((r, left, top, w, h))
+    # BGR -> RGB, NHWC -> NCHW, [0, 1]
+    tensor = np.ascontiguousarray(batch[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+    tensor *= 1.0 / 255.0
+    return tensor, meta
+
+
+class OnnxPlateDetector:
+    """Детектор номеров на onnxruntime без ultralytics/torch.
+
+    Ожидает ONNX-экспорт YOLOv8 (выход [batch, 4 + классы, N]: cx, cy, w, h
+    в пикселях входа и оценки классов). Предобработка (letterbox), декодирование
+    и NMS сделаны на NumPy, пороги по умолчанию совпадают с ultralytics
+    (conf=0.25, iou=0.7).
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        conf: float = 0.25,
+        iou: float = 0.7,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        imgsz: int = 640,
+    ):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(0, int(intra_op_threads))
+        options.inter_op_num_threads = max(0, int(inter_op_threads))
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        shape = list(inp.shape)
+        # Статический размер входа берём из модели, для динамического — imgsz
+        self.height = shape[2] if isinstance(shape[2], int) else int(imgsz)
+        self.width = shape[3] if isinstance(shape[3], int) else int(imgsz)
+        # Модель с фиксированным batch=1 гоняем по одному изображению
+        self.max_batch = shape[0] if isinstance(shape[0], int) else None
+        self.conf = float(conf)
+        self.iou = float(iou)
+
+    def _letterbox(self, images: Sequence[np.ndarray]):
+        return letterbox(images, self.height, self.width)
+
+    def _decode(self, pred: np.ndarray, meta) -> List[Box]:
+        # pred: [4 + классы, N] -> [N, 4 + классы]
+        if pred.shape[0] < pred.shape[1]:
+            pred = pred.T
+        scores_all = pred[:, 4:]
+        cls = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(cls)), cls]
+        mask = scores > self.conf
+        if not mask.any():
+            return []
+        xywh, scores, cls = pred[mask, :4], scores[mask], cls[mask]
+
+        r, left, top, w, h = meta
+        boxes = np.empty_like(xywh)
+        boxes[:, 0] = xywh[:, 0] - xywh[:, 2] / 2
+        boxes[:, 1] = xywh[:, 1] - xywh[:, 3] / 2
+        boxes[:, 2] = xywh[:, 0] + xywh[:, 2] / 2
+        boxes[:, 3] = xywh[:, 1] + xywh[:, 3] / 2
+
+        # NMS по классам: сдвигаем боксы разных классов, чтобы они не пересекались
+        offsets = cls[:, None].astype(boxes.dtype) * 7680.0
+        keep = _nms(boxes + offsets, scores, self.iou)
+        boxes = boxes[keep]
+
+        # Обратно в координаты исходного изображения
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - left) / r
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - top) / r
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        return [tuple(int(v) for v in b) for b in boxes]
+
+    def detect(self, images: Sequence[np.ndarray]) -> List[List[Box]]:
+        """Боксы (x1, y1, x2, y2) для каждого изображения в порядке входа."""
+        images = list(images)
+        step = self.max_batch or max(1, len(images))
+        out: List[List[Box]] = []
+        for start in range(0, len(images), step):
+            chunk = images[start:start + step]
+            tensor, meta = self._letterbox(chunk)
+            preds = self.session.run(None, {self.input_name: tensor})[0]
+            for pred, m in zip(preds, meta):
+                out.append(self._decode(pred, m))
+        return out
+
+
+def quantized_model_path(model_path: str, mode: str) -> str:
+    """Путь к квантованному варианту рядом с исходной моделью: <model>.int8-<mode>.onnx."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.int8-{mode}.onnx"
+
+
+def _input_spec(model_path: str, imgsz: int):
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    inp = session.get_inputs()[0]
+    shape = list(inp.shape)
+    height = shape[2] if isinstance(shape[2], int) else int(imgsz)
+    width = shape[3] if isinstance(shape[3], int) else int(imgsz)
+    return inp.name, height, width
+
+
+def quantize_model(
+    model_path: str,
+    mode: str = "dynamic",
+    calibration_images: Iterable[str] = (),
+    imgsz: int = 640,
+) -> str:
+    """Возвращает путь к int8-варианту ONNX-модели, создавая его при необходимости.
+
+    Квантованный файл кэшируется рядом с исходным и пересоздаётся, только если
+    исходная модель новее. Для static нужны калибровочные изображения: по ним
+    onnxruntime оценивает диапазоны активаций (предобработка та же, что при инференсе).
+    """
+    mode = str(mode or "none").strip().lower()
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    if mode == "none":
+        return model_path
+    if not model_path.lower().endswith(".onnx"):
+        raise ValueError(f"Quantization requires an ONNX model, got: {model_path}")
+
+    out_path = quantized_model_path(model_path, mode)
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(model_path):
+        return out_path
+
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    # Пишем во временный файл: параллельный процесс не подхватит недописанную модель
+    tmp_path = f"{os.path.splitext(out_path)[0]}.{os.getpid()}.tmp.onnx"
+    try:
+        if mode == "dynamic":
+            # ConvInteger в onnxruntime на CPU работает с uint8-весами
+            quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QUInt8)
+        else:
+            images = [img for img in (cv2.imread(p) for p in calibration_images) if img is not None]
+            if not images:
+                raise ValueError("Static quantization requires calibration images")
+            input_name, height, width = _input_spec(model_path, imgsz)
+
+            class _Reader(CalibrationDataReader):
+                def __init__(self):
+                    self._it = iter(images)
+
+                def get_next(self):
+                    img = next(self._it, None)
+                    if img is None:
+                        return None
+                    tensor, _ = letterbox([img], height, width)
+                    return {input_name: tensor}
+
+            quantize_static(
+                model_path,
+                tmp_path,
+                _Reader(),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+            )
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return out_path
+
+
+__all__ = ["OnnxPlateDetector", "QUANTIZE_MODES", "letterbox", "quantize_model", "quantized_model_path"]
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+
+from . import image_moderator as _im
+
+
+# fork копирует процесс со всеми его потоками (загрузки, конвейер, метрики,
+# torch/onnxruntime), и дочерний процесс может зависнуть на чужой блокировке
+START_METHODS = ("forkserver", "spawn")
+
+
+def _init_worker(model_path: str, options, decode_reduction: int, threads: int) -> None:
+    """Инициализация процесса пула: те же настройки детектора, модель грузится один раз."""
+    # Процессов столько же, сколько ядер, поэтому внутренний параллелизм ограничиваем
+    cv2.setNumThreads(1)
+    _im.configure_detector(
+        backend=options.backend,
+        conf=options.conf,
+        iou=options.iou,
+        intra_op_threads=options.intra_op_threads or threads,
+        inter_op_threads=options.inter_op_threads,
+        quantize=options.quantize,
+        imgsz=options.imgsz,
+        calibration_dir=options.calibration_dir,
+        decode_reduction=decode_reduction,
+    )
+    _im.get_model(model_path)
+    if options.backend == "ultralytics":
+        # torch уже импортирован ultralytics при загрузке модели
+        import torch  # type: ignore
+
+        torch.set_num_threads(threads)
+
+
+def _ping(_=None) -> int:
+    return os.getpid()
+
+
+class ImageWorkerPool:
+    """Пул процессов для декодирования, инференса и кодирования изображений.
+
+    Каждый процесс загружает детектор один раз при старте (initializer) и
+    затем получает пачки изображений; обратно возвращаются только боксы и
+    закодированные покрытые изображения (см. cover_images). Настройки
+    детектора берутся из текущего configure_detector на момент создания пула.
+
+    Процессы запускаются через forkserver или spawn (START_METHODS), а не
+    fork: к моменту запуска и тем более перезапуска пула у родителя уже
+    работают потоки, а их блокировки в копии процесса никто не отпустит.
+    Настройки детектора передаются в initializer и применяются через
+    configure_detector, модель загружается в каждом процессе. Метрики
+    процессов пула попадают в /metrics в multiprocess-режиме prometheus_client
+    (PROMETHEUS_MULTIPROC_DIR, см. src/metrics.py).
+    """
+
+    def __init__(self, model_path: str, workers: int, start_method: str = "forkserver"):
+        if start_method not in START_METHODS:
+            raise ValueError(f"Unsupported start method for image workers: {start_method} (use {', '.join(START_METHODS)})")
+        self.model_path = model_path
+        self.workers = max(1, int(workers))
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == "forkserver":
+            # Сервер один раз импортирует тяжёлые модули, дети получают их готовыми
+            self._context.set_forkserver_preload([__name__])
+        self._initargs = (
+            model_path, _im._options, _im._decode_reduction, max(1, (os.cpu_count() or 1) // self.workers)
+        )
+        self._executor = self._make_executor()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+
+    def _make_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=self._initargs,
+        )
+
+    def start(self) -> None:
+        """Запускает процессы заранее (до появления рабочих потоков) и ждёт загрузки модели."""
+        pids = set(self._executor.map(_ping, range(self.workers)))
+        self._logger.info("[IMAGE][POOL] %d workers ready (pids=%s)", self.workers, sorted(pids))
+
+    def cover(self, pending, batch_size: int = _im.DEFAULT_BATCH_SIZE, with_phash: bool = False):
+        """cover_images по пачкам batch_size в процессах пула; результаты в порядке pending."""
+        batch_size = max(1, int(batch_size or 1))
+        executor = self._executor
+        futures = [
+            executor.submit(
+                _im.cover_images, pending[start:start + batch_size], self.model_path, batch_size, with_phash
+            )
+            for start in range(0, len(pending), batch_size)
+        ]
+        results = []
+        try:
+            for future in futures:
+                results.extend(future.result())
+        except BrokenProcessPool:
+            # Процесс упал (например, OOM): пересоздаём пул, текущее объявление отдаём как ошибку
+            with self._lock:
+                if self._executor is executor:
+                    self._logger.error("[IMAGE][POOL][ERROR] worker died, restarting pool")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._make_executor()
+            raise
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+__all__ = ["ImageWorkerPool"]
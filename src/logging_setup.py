@@ -7,6 +7,10 @@ import sys
 from logging.handlers import RotatingFileHandler
 
 
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra=...
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
 class _JsonFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         payload = {
@@ -15,10 +19,14 @@ class _JsonFormatter(logging.Formatter):
             "name": record.name,
             "message": record.getMessage(),
         }
+        # Структурированные поля из extra (ad_id, timings и т.п.) — отдельными ключами
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in payload and not key.startswith("_"):
+                payload[key] = value
         # Добавим основные поля, если есть
         if record.exc_info:
             payload["exc_info"] = self.formatException(record.exc_info)
-        return json.dumps(payload, ensure_ascii=False)
+        return json.dumps(payload, ensure_ascii=False, default=str)
 
 
 def _make_formatter(fmt: str) -> logging.Formatter:
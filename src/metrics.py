@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import logging
+import os
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client import start_http_server as _start_http_server
+
+# Границы гистограмм по умолчанию (секунды): от миллисекунд до минуты
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def multiprocess_enabled() -> bool:
+    """Включён ли multiprocess-режим prometheus_client (PROMETHEUS_MULTIPROC_DIR).
+
+    В этом режиме каждый процесс, включая процессы пула изображений, пишет
+    значения в файлы каталога, а /metrics собирает их все. Переменная должна
+    быть задана до запуска процесса, а каталог — очищен перед стартом.
+    """
+    return bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> None:
+    """Поднимает /metrics в фоновом потоке (в multiprocess-режиме — по всем процессам)."""
+    registry = REGISTRY
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    _start_http_server(int(port), host, registry=registry)
+    logging.getLogger(__name__).info("[METRICS] serving http://%s:%s/metrics", host, port)
+
+
+# ---------- Метрики модерации ----------
+# Gauge пишет только основной процесс; livesum даёт его значение и в multiprocess-режиме
+STAGE_SECONDS = Histogram(
+    "moderation_stage_seconds", "Time spent by one ad in a pipeline stage", ["stage"], buckets=DEFAULT_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    "moderation_stage_errors_total", "Ads dropped because a pipeline stage raised", ["stage"]
+)
+QUEUE_DEPTH = Gauge(
+    "moderation_queue_depth", "Ads waiting in the queue in front of a pipeline stage", ["stage"],
+    multiprocess_mode="livesum",
+)
+ADS_PROCESSED = Counter(
+    "moderation_ads_processed_total", "Ads that passed every pipeline stage"
+)
+ADS_PER_SECOND = Gauge(
+    "moderation_ads_per_second", "Throughput of the last run_once batch", multiprocess_mode="livesum"
+)
+OLDEST_PAID_AGE = Gauge(
+    "moderation_oldest_paid_age_seconds", "Age of the oldest ad waiting in PAID status", multiprocess_mode="livesum"
+)
+DOWNLOAD_SECONDS = Histogram(
+    "moderation_download_seconds", "Latency of one image download", ["host"], buckets=DEFAULT_BUCKETS
+)
+DOWNLOAD_BYTES = Counter(
+    "moderation_download_bytes_total", "Bytes of images downloaded", ["host"]
+)
+DOWNLOAD_ERRORS = Counter(
+    "moderation_download_errors_total", "Image downloads that failed after all retries", ["host"]
+)
+TEXT_MODEL_SECONDS = Histogram(
+    "moderation_text_model_seconds", "Duration of one batched text moderation call", buckets=DEFAULT_BUCKETS
+)
+IMAGE_DECODE_SECONDS = Histogram(
+    "moderation_image_decode_seconds", "Decoding of one image for detection", buckets=DEFAULT_BUCKETS
+)
+INFERENCE_SECONDS = Histogram(
+    "moderation_inference_seconds", "One detector call over a batch of images", buckets=DEFAULT_BUCKETS
+)
+COVER_SECONDS = Histogram(
+    "moderation_cover_seconds", "Full-size decode and plate painting of one image with plates", buckets=DEFAULT_BUCKETS
+)
+IMAGE_ENCODE_SECONDS = Histogram(
+    "moderation_image_encode_seconds", "Encoding of one covered image", buckets=DEFAULT_BUCKETS
+)
+UPLOAD_SECONDS = Histogram(
+    "moderation_upload_seconds", "Upload of one covered image to MinIO", buckets=DEFAULT_BUCKETS
+)
+UPLOAD_BYTES = Counter(
+    "moderation_upload_bytes_total", "Bytes of covered images uploaded to MinIO"
+)
+DB_SECONDS = Histogram(
+    "moderation_db_seconds", "Duration of a database operation", ["op"], buckets=DEFAULT_BUCKETS
+)
+
+
+__all__ = [
+    "multiprocess_enabled",
+    "start_http_server",
+    "STAGE_SECONDS",
+    "STAGE_ERRORS",
+    "QUEUE_DEPTH",
+    "ADS_PROCESSED",
+    "ADS_PER_SECOND",
+    "OLDEST_PAID_AGE",
+    "DOWNLOAD_SECONDS",
+    "DOWNLOAD_BYTES",
+    "DOWNLOAD_ERRORS",
+    "TEXT_MODEL_SECONDS",
+    "IMAGE_DECODE_SECONDS",
+    "INFERENCE_SECONDS",
+    "COVER_SECONDS",
+    "IMAGE_ENCODE_SECONDS",
+    "UPLOAD_SECONDS",
+    "UPLOAD_BYTES",
+    "DB_SECONDS",
+]
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+from .metrics import QUEUE_DEPTH, STAGE_ERRORS, STAGE_SECONDS
+
+# Маркер конца потока данных между стадиями
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    """Стадия конвейера: функция над элементом и число её рабочих потоков.
+
+    func получает элемент и возвращает элемент для следующей стадии;
+    None означает, что элемент дальше не передаётся.
+    """
+
+    name: str
+    func: Callable[[Any], Optional[Any]]
+    workers: int = 1
+
+
+def run_pipeline(source: Iterable[Any], stages: List[Stage], queue_size: int = 4) -> int:
+    """Прогоняет элементы source через стадии, каждая — в своих потоках.
+
+    Между стадиями — ограниченные очереди размера queue_size, поэтому пока
+    одна стадия занята (например, инференсом), соседние продолжают работать
+    (скачивание следующего объявления, загрузка предыдущего), а число
+    элементов «в полёте» ограничено. Ошибка на элементе логируется, элемент
+    отбрасывается, остальные продолжают обработку. Время каждой стадии,
+    ошибки и глубина входных очередей попадают в метрики (src/metrics.py).
+
+    Возвращает число элементов, прошедших все стадии.
+    """
+    logger = logging.getLogger(__name__)
+    queue_size = max(1, int(queue_size or 1))
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    completed = [0]
+    completed_lock = threading.Lock()
+    threads: List[threading.Thread] = []
+    # Глубина входной очереди стадии обновляется при каждом put/get
+    # (qsize приблизителен, но для наблюдения за узким местом этого достаточно)
+    depth = [QUEUE_DEPTH.labels(stage=stage.name) for stage in stages] + [None]
+
+    def _put(idx: int, item: Any) -> None:
+        queues[idx].put(item)
+        if depth[idx] is not None:
+            depth[idx].set(queues[idx].qsize())
+
+    def _worker(stage: Stage, idx: int, remaining: List[int], lock: threading.Lock):
+        inbox = queues[idx]
+        while True:
+            item = inbox.get()
+            depth[idx].set(inbox.qsize())
+            if item is _STOP:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                # Последний завершившийся поток стадии закрывает следующую очередь
+                if last:
+                    queues[idx + 1].put(_STOP)
+                else:
+                    inbox.put(_STOP)
+                return
+            started = time.perf_counter()
+            try:
+                result = stage.func(item)
+            except Exception:
+                STAGE_ERRORS.labels(stage=stage.name).inc()
+                logger.exception("[PIPELINE][%s][ERROR] item dropped", stage.name)
+                continue
+            finally:
+                STAGE_SECONDS.labels(stage=stage.name).observe(time.perf_counter() - started)
+            if result is not None:
+                _put(idx + 1, result)
+
+    for idx, stage in enumerate(stages):
+        workers = max(1, int(stage.workers or 1))
+        remaining = [workers]
+        lock = threading.Lock()
+        for n in range(workers):
+            t = threading.Thread(
+                target=_worker,
+                args=(stage, idx, remaining, lock),
+                name=f"pipeline-{stage.name}-{n}",
+                daemon=True,
+            )
+            t.start()
+            threads.append(t)
+
+    def _drain_tail():
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                return
+            with completed_lock:
+                completed[0] += 1
+
+    tail = threading.Thread(target=_drain_tail, name="pipeline-tail", daemon=True)
+    tail.start()
+
+    # Источник (выборка из БД) работает в вызывающем потоке
+    try:
+        for item in source:
+            _put(0, item)
+    finally:
+        queues[0].put(_STOP)
+        for t in threads:
+            t.join()
+        tail.join()
+        for gauge in depth[:-1]:
+            gauge.set(0)
+
+    return completed[0]
+
+
+__all__ = ["Stage", "run_pipeline"]
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import psycopg
+from minio import Minio
+from psycopg_pool import ConnectionPool
+
+from .config import AppConfig
+from .db import (
+    PgImageCacheStore,
+    PgTextCacheStore,
+    apply_retention,
+    ensure_partitions,
+    get_conn,
+    init_db,
+    make_pool,
+    prune_image_cache,
+)
+from .image_moderator.detection_cache import DetectionCache
+from .image_moderator.image_moderator import detector_identity
+from .image_moderator.workers import ImageWorkerPool
+from .text_moderator.text_moderator import configure_text_cache
+from .storage import _make_client, ensure_bucket
+
+
+class Runtime:
+    """Долгоживущие ресурсы планировщика: пул соединений PostgreSQL, клиент MinIO и кэши.
+
+    Схема БД и бакеты готовятся один раз (ensure_ready), а не на каждом запуске
+    run_once. Пул сам проверяет соединения при выдаче и заменяет оборванные;
+    клиент MinIO пересоздаётся после ошибки (reset_minio).
+    """
+
+    def __init__(self, cfg: AppConfig):
+        self.cfg = cfg
+        self._lock = threading.Lock()
+        self._pool: Optional[ConnectionPool] = None
+        self._minio: Optional[Minio] = None
+        self._ready = False
+        self._logger = logging.getLogger(__name__)
+        self._image_cache: Optional[DetectionCache] = None
+        self._image_pool: Optional[ImageWorkerPool] = None
+        self._maintained_at = 0.0
+        self._maintenance: Optional[threading.Thread] = None
+
+    def ensure_ready(self) -> None:
+        """Создаёт таблицы и бакеты; после успеха повторные вызовы ничего не делают."""
+        with self._lock:
+            if self._ready:
+                return
+            cfg = self.cfg
+            init_db(cfg.db)
+            client = self._minio_locked()
+            ensure_bucket(client, cfg.minio.system_bucket, public=False)
+            ensure_bucket(client, cfg.minio.client_bucket, public=cfg.minio.client_public_access)
+            self._configure_text_cache()
+            self._ready = True
+            self._logger.info("[RUNTIME][READY] schema and buckets initialized")
+
+    def maintain(self, every_seconds: float = 3600.0) -> None:
+        """Запускает обслуживание в фоне не чаще раза в every_seconds: будущие секции,
+        удаление старых данных и записей кэша детекций.
+
+        Работает в отдельном потоке на собственном соединении (вне пула), поэтому
+        пачка модерации не ждёт ни отсоединения секций, ни построчного удаления.
+        Пока предыдущий проход не закончился, новый не запускается.
+        """
+        with self._lock:
+            if self._maintenance is not None and self._maintenance.is_alive():
+                return
+            now = time.monotonic()
+            if self._maintained_at and now - self._maintained_at < every_seconds:
+                return
+            self._maintained_at = now
+            self._maintenance = threading.Thread(target=self._maintain, name="db-maintenance", daemon=True)
+            self._maintenance.start()
+
+    def _maintain(self) -> None:
+        """Один проход обслуживания; ошибки логируются и не мешают модерации."""
+        db = self.cfg.db
+        try:
+            with get_conn(db, autocommit=True) as conn:
+                ensure_partitions(conn, db.partition_interval, db.partitions_ahead)
+                apply_retention(conn, db.retention_days)
+                ic = self.cfg.image_cache
+                if ic.enabled and ic.persistent:
+                    prune_image_cache(conn, detector_identity(self.cfg.model_path), ic.ttl_days)
+        except Exception as e:
+            self._logger.warning("[RUNTIME][MAINTENANCE][ERROR] %s", e)
+
+    def _configure_text_cache(self) -> None:
+        tc = self.cfg.text_cache
+        if not tc.enabled:
+            configure_text_cache(0)
+            return
+        if tc.persistent and self._pool is None:
+            self._pool = self._make_pool()
+        store = PgTextCacheStore(self._pool) if tc.persistent else None
+        configure_text_cache(tc.max_entries, store=store)
+
+    def required_connections(self) -> int:
+        """Сколько соединений run_once может держать одновременно.
+
+        Два на весь запуск (запись результатов и захват страниц очереди) плюс
+        по одному на каждый поток, обращающийся к постоянным кэшам: потоки
+        стадии изображений и загрузки (кэш детекций) и поток текстовой модели.
+        """
+        pipeline = self.cfg.pipeline
+        needed = 2
+        if self.cfg.image_cache.enabled and self.cfg.image_cache.persistent:
+            needed += max(pipeline.image_workers, pipeline.image_processes) + pipeline.upload_workers
+        if self.cfg.text_cache.enabled and self.cfg.text_cache.persistent:
+            needed += 1
+        return needed
+
+    def _make_pool(self) -> ConnectionPool:
+        needed = self.required_connections()
+        if needed > self.cfg.db.pool_max_size:
+            self._logger.warning(
+                "[RUNTIME][POOL] DB_POOL_MAX_SIZE=%d is below %d concurrent users, using %d",
+                self.cfg.db.pool_max_size, needed, needed,
+            )
+        return make_pool(self.cfg.db, min_max_size=needed)
+
+    def _minio_locked(self) -> Minio:
+        if self._minio is None:
+            self._minio = _make_client(self.cfg.minio)
+        return self._minio
+
+    @property
+    def minio(self) -> Minio:
+        with self._lock:
+            return self._minio_locked()
+
+    def reset_minio(self) -> None:
+        """Сбрасывает клиент MinIO; следующий вызов minio создаст новый."""
+        with self._lock:
+            self._minio = None
+
+    @property
+    def pool(self) -> ConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._make_pool()
+            return self._pool
+
+    @property
+    def image_cache(self) -> Optional[DetectionCache]:
+        """Кэш детекций по содержимому изображений (None, если выключен).
+
+        Создаётся после configure_detector и привязан к текущему детектору:
+        записи другой модели или других параметров из таблицы не читаются.
+        """
+        cfg = self.cfg.image_cache
+        if not cfg.enabled:
+            return None
+        if self._image_cache is None:
+            store = PgImageCacheStore(self.pool, detector_identity(self.cfg.model_path)) if cfg.persistent else None
+            with self._lock:
+                if self._image_cache is None:
+                    self._image_cache = DetectionCache(cfg.max_entries, store=store, use_phash=cfg.use_phash)
+        return self._image_cache
+
+    @property
+    def image_pool(self) -> Optional[ImageWorkerPool]:
+        """Пул процессов для изображений (None, если IMAGE_PROCESS_WORKERS=0); запускается при первом обращении."""
+        pipeline = self.cfg.pipeline
+        if pipeline.image_processes <= 0:
+            return None
+        with self._lock:
+            if self._image_pool is None:
+                pool = ImageWorkerPool(
+                    self.cfg.model_path, pipeline.image_processes, pipeline.image_process_start_method
+                )
+                pool.start()
+                self._image_pool = pool
+            return self._image_pool
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg.Connection]:
+        """Соединение из пула на время блока; после блока возвращается в пул."""
+        with self.pool.connection() as conn:
+            yield conn
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+            self._minio = None
+            self._image_cache = None
+            if self._image_pool is not None:
+                self._image_pool.close()
+                self._image_pool = None
+            if self._ready:
+                # Хранилище кэша опиралось на закрытый пул
+                configure_text_cache(self.cfg.text_cache.max_entries if self.cfg.text_cache.enabled else 0)
+            self._ready = False
+
+
+__all__ = ["Runtime"]
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
 import datetime as dt
+import io
 import logging
+import mimetypes
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 from minio import Minio
 from minio.error import S3Error
 
 from .config import MinioConfig
+from .metrics import UPLOAD_BYTES, UPLOAD_SECONDS
 
 
 def _make_client(cfg: MinioConfig) -> Minio:
@@ -91,6 +98,90 @@ def upload_file(client: Minio, bucket: str, local_path: str, object_name: str) -
         raise
 
 
+def upload_bytes(client: Minio, bucket: str, data: bytes, object_name: str, content_type: str | None = None) -> str:
+    """Загрузка объекта из памяти (put_object) без промежуточного файла.
+
+    Возвращает object_name при успехе, пробрасывает исключение при ошибке.
+    """
+    logger = logging.getLogger(__name__)
+    if content_type is None:
+        content_type = mimetypes.guess_type(object_name)[0] or "application/octet-stream"
+    size = len(data)
+    try:
+        logger.info(
+            "[S3][UPLOAD][START] bucket=%s key=%s size=%s", bucket, object_name, size
+        )
+        started = time.perf_counter()
+        client.put_object(bucket, object_name, io.BytesIO(data), size, content_type=content_type)
+        UPLOAD_SECONDS.observe(time.perf_counter() - started)
+        UPLOAD_BYTES.inc(size)
+        logger.info("[S3][UPLOAD][DONE] bucket=%s key=%s", bucket, object_name)
+        return object_name
+    except S3Error as e:
+        logger.error(
+            "[S3][UPLOAD][ERROR] bucket=%s key=%s code=%s message=%s",
+            bucket,
+            object_name,
+            getattr(e, "code", None),
+            str(e),
+        )
+        raise
+    except Exception:
+        logger.exception(
+            "[S3][UPLOAD][ERROR] bucket=%s key=%s unexpected error", bucket, object_name
+        )
+        raise
+
+
+@dataclass
+class UploadResult:
+    object_name: str
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+
+
+def _upload_one(client: Minio, bucket: str, source: Union[bytes, str], object_name: str, retries: int) -> UploadResult:
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                upload_bytes(client, bucket, bytes(source), object_name)
+            else:
+                upload_file(client, bucket, source, object_name)
+            return UploadResult(object_name=object_name, ok=True, attempts=attempt)
+        except Exception as e:
+            if attempt > retries:
+                return UploadResult(object_name=object_name, ok=False, attempts=attempt, error=str(e))
+            time.sleep(0.5 * attempt)
+
+
+def upload_objects(
+    client: Minio,
+    bucket: str,
+    items: Iterable[Tuple[Union[bytes, str], str]],
+    max_workers: int = 4,
+    retries: int = 2,
+) -> List[UploadResult]:
+    """Параллельная загрузка набора объектов.
+
+    items — пары (bytes или путь к локальному файлу, object_name). Каждый объект
+    загружается с retries повторами; не более max_workers загрузок одновременно.
+    Исключения не пробрасываются: возвращается UploadResult на каждый объект
+    в порядке items.
+    """
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(int(max_workers or 1), len(items)))
+    if workers == 1:
+        return [_upload_one(client, bucket, src, key, retries) for src, key in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as executor:
+        futures = [executor.submit(_upload_one, client, bucket, src, key, retries) for src, key in items]
+        return [f.result() for f in futures]
+
+
 def get_presigned_url(client: Minio, bucket: str, object_name: str, expires: dt.timedelta = dt.timedelta(hours=1)) -> str:
     seconds = int(expires.total_seconds())
     # Ограничение MinIO/S3: максимум 7 дней; оставим как есть
@@ -113,6 +204,9 @@ __all__ = [
     "_make_client",
     "ensure_bucket",
     "upload_file",
+    "upload_bytes",
+    "upload_objects",
+    "UploadResult",
     "get_presigned_url",
     "build_object_url",
 ]
@@ -1,3 +1,3 @@
-from .text_moderator import moderate_text
+from .text_moderator import moderate_text, moderate_texts, configure_text_cache
 
-__all__ = ["moderate_text"]
+__all__ = ["moderate_text", "moderate_texts", "configure_text_cache"]
@@ -1,6 +1,13 @@
+import hashlib
+import inspect
+import json
+import logging
 import os
 from typing import List, Optional
 
+from ..cache import LruCache
+from ..metrics import TEXT_MODEL_SECONDS
+
 # ---------- Параметры ----------
 # Локальный путь к модели токсичности
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -28,10 +35,222 @@ def _import_pipeline():
         return None
 
 
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, str(default)))
+    except ValueError:
+        return default
+
+
+def _tox_backend() -> str:
+    # transformers (по умолчанию) | onnx
+    return str(os.environ.get("TEXT_TOX_BACKEND", "transformers")).strip().lower()
+
+
+def _onnx_quantize() -> bool:
+    return str(os.environ.get("TEXT_ONNX_QUANTIZE", "0")).strip().lower() in {"1", "true", "yes", "on", "y"}
+
+
+# Версия экспорта: файлы без маркера этой версии (в т.ч. экспортированные
+# раньше с перепутанными именами входов) экспортируются и проверяются заново
+_ONNX_EXPORT_VERSION = "2"
+
+# Тексты разной длины: в пачке есть паддинг, поэтому перепутанные
+# attention_mask/token_type_ids сразу дают расхождение
+_PARITY_TEXTS = [
+    "пример текста",
+    "Продаю автомобиль в хорошем состоянии, один владелец, торг уместен",
+    "ок",
+]
+
+
+def _forward_input_names(model, tokenizer_keys) -> List[str]:
+    """Входы модели в порядке сигнатуры forward: в этом порядке torch.onnx.export раскладывает аргументы."""
+    keys = set(tokenizer_keys)
+    return [name for name in inspect.signature(model.forward).parameters if name in keys]
+
+
+def _export_onnx(model_dir: str, onnx_path: str) -> None:
+    """Экспорт классификатора в ONNX (нужен torch; выполняется один раз)."""
+    import torch  # type: ignore
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer  # type: ignore
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    sample = tokenizer(_PARITY_TEXTS, padding=True, return_tensors="pt")
+    names = _forward_input_names(model, sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic_axes["logits"] = {0: "batch"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            # Именованные аргументы в порядке forward — в том же порядке, что и input_names
+            ({name: sample[name] for name in names},),
+            onnx_path,
+            input_names=names,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+
+
+def _check_onnx_parity(model_dir: str, onnx_path: str, quantized: bool = False) -> None:
+    """Сравнивает выход ONNX-модели с моделью transformers на _PARITY_TEXTS; при расхождении — RuntimeError.
+
+    Для float-экспорта логиты должны совпасть почти точно; для int8 допускается
+    небольшое отклонение вероятностей при совпадении предсказанных меток.
+    """
+    import numpy as np  # type: ignore
+    import onnxruntime as ort  # type: ignore
+    import torch  # type: ignore
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer  # type: ignore
+
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    model.eval()
+    enc = tokenizer(_PARITY_TEXTS, padding=True, truncation=True, return_tensors="pt")
+    with torch.no_grad():
+        expected = model(**enc).logits.numpy()
+
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    feed = {i.name: enc[i.name].numpy().astype(np.int64) for i in session.get_inputs()}
+    actual = session.run(None, feed)[0]
+
+    if quantized:
+        def _probs(logits):
+            exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+            return exp / exp.sum(axis=-1, keepdims=True)
+
+        diff = float(np.abs(_probs(expected) - _probs(actual)).max())
+        ok = diff <= 0.1 and (expected.argmax(axis=-1) == actual.argmax(axis=-1)).all()
+    else:
+        diff = float(np.abs(expected - actual).max())
+        ok = diff <= 1e-3
+    if not ok:
+        raise RuntimeError(f"ONNX model {onnx_path} diverges from transformers (max diff {diff:.4g})")
+
+
+def _verified(path: str) -> bool:
+    try:
+        with open(path + ".ok", encoding="utf-8") as f:
+            return os.path.exists(path) and f.read().strip() == _ONNX_EXPORT_VERSION
+    except OSError:
+        return False
+
+
+def _mark_verified(path: str) -> None:
+    with open(path + ".ok", "w", encoding="utf-8") as f:
+        f.write(_ONNX_EXPORT_VERSION)
+
+
+def _discard(path: str) -> None:
+    for p in (path, path + ".ok"):
+        if os.path.exists(p):
+            os.remove(p)
+
+
+def _ensure_onnx_model(model_dir: str, quantize: bool) -> str:
+    """Путь к ONNX-модели в model_dir; при отсутствии экспортирует и квантует её.
+
+    Новый файл используется только после проверки на совпадение с моделью
+    transformers (_check_onnx_parity); проверенный файл помечается <файл>.ok.
+    """
+    onnx_path = os.path.join(model_dir, "model.onnx")
+    int8_path = os.path.join(model_dir, "model.int8.onnx")
+    if not _verified(onnx_path):
+        # Квантованная модель получена из старого экспорта — пересоздаём и её
+        _discard(int8_path)
+        _export_onnx(model_dir, onnx_path)
+        try:
+            _check_onnx_parity(model_dir, onnx_path)
+        except Exception:
+            _discard(onnx_path)
+            raise
+        _mark_verified(onnx_path)
+    if not quantize:
+        return onnx_path
+    if not _verified(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+
+        quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+        try:
+            _check_onnx_parity(model_dir, int8_path, quantized=True)
+        except Exception:
+            _discard(int8_path)
+            raise
+        _mark_verified(int8_path)
+    return int8_path
+
+
+class _OnnxTextClassifier:
+    """Классификатор текста на onnxruntime с интерфейсом pipeline(return_all_scores=True).
+
+    Возвращает для каждого текста список {"label", "score"} по всем меткам,
+    как text-classification pipeline из transformers.
+    """
+
+    def __init__(self, model_dir: str, quantize: bool = False, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import numpy as np  # type: ignore
+        import onnxruntime as ort  # type: ignore
+        from transformers import AutoConfig, AutoTokenizer  # type: ignore
+
+        self._np = np
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        config = AutoConfig.from_pretrained(model_dir)
+        self.id2label = {int(k): v for k, v in config.id2label.items()}
+        # Та же функция активации, что выбирает pipeline по умолчанию
+        self.sigmoid = config.problem_type == "multi_label_classification" or config.num_labels == 1
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(0, int(intra_op_threads))
+        options.inter_op_num_threads = max(0, int(inter_op_threads))
+        path = _ensure_onnx_model(model_dir, quantize)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _scores(self, logits):
+        np = self._np
+        if self.sigmoid:
+            return 1.0 / (1.0 + np.exp(-logits))
+        shifted = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(shifted)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def __call__(self, inputs, batch_size: int = 1, truncation: bool = True, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        batch_size = max(1, int(batch_size or 1))
+        out = []
+        for start in range(0, len(texts), batch_size):
+            chunk = texts[start:start + batch_size]
+            enc = self.tokenizer(chunk, padding=True, truncation=truncation, return_tensors="np")
+            feed = {k: v.astype(self._np.int64) for k, v in enc.items() if k in self.input_names}
+            logits = self.session.run(None, feed)[0]
+            for row in self._scores(logits):
+                out.append([
+                    {"label": self.id2label.get(i, f"LABEL_{i}"), "score": float(score)}
+                    for i, score in enumerate(row)
+                ])
+        return out
+
+
 def _get_tox_classifier():
     global _tox_classifier
     if _tox_classifier is not None:
         return _tox_classifier
+    if _tox_backend() == "onnx":
+        try:
+            _tox_classifier = _OnnxTextClassifier(
+                TOXIC_MODEL_PATH,
+                quantize=_onnx_quantize(),
+                intra_op_threads=_env_int("TEXT_ONNX_INTRA_OP_THREADS", 0),
+                inter_op_threads=_env_int("TEXT_ONNX_INTER_OP_THREADS", 0),
+            )
+            return _tox_classifier
+        except Exception as e:
+            # Откатываемся на обычный pipeline transformers
+            logging.getLogger(__name__).warning("[TEXT][ONNX][ERROR] backend unavailable: %s", e)
+            _tox_classifier = None
     pipeline = _import_pipeline()
     if pipeline is None:
         return None
@@ -47,13 +266,16 @@ def _get_tox_classifier():
     return _tox_classifier
 
 
+def _zs_enabled() -> bool:
+    return str(os.environ.get("TEXT_ZEROSHOT_ENABLED", "0")).strip().lower() in {"1", "true", "yes", "on", "y"}
+
+
 def _get_zs_classifier():
     global _zs_classifier
     if _zs_classifier is not None:
         return _zs_classifier
     # Делаем zero-shot опциональным: можно отключить через переменную окружения
-    zs_enabled = str(os.environ.get("TEXT_ZEROSHOT_ENABLED", "0")).strip().lower() in {"1", "true", "yes", "on", "y"}
-    if not zs_enabled:
+    if not _zs_enabled():
         return None
     pipeline = _import_pipeline()
     if pipeline is None:
@@ -67,95 +289,309 @@ def _get_zs_classifier():
         _zs_classifier = None
     return _zs_classifier
 
-# ---------- Функции модерации текста ----------
-def moderate_text_ai(text: str) -> List[dict]:
-    """
-    Возвращает список детекций для текста:
-    - type: "text"
-    - category: trash_talk | politics | crypto
-    - score: вероятность
-    - value: исходный текст / токен
+# ---------- Кэш результатов ----------
+# Ключ — хэш нормализованного текста, идентичности моделей и порогов,
+# так что смена модели или порога не отдаёт устаревший результат.
+_text_cache: Optional[LruCache] = LruCache(10000)
+_text_cache_store = None
+
+
+def configure_text_cache(max_entries: int = 10000, store=None) -> None:
+    """Настраивает кэш текстовой модерации.
+
+    max_entries — размер LRU в процессе (0 — кэш выключен);
+    store — опциональное постоянное хранилище с методами get(key) и put(key, detections)
+    (см. db.PgTextCacheStore).
     """
-    detections: List[dict] = []
+    global _text_cache, _text_cache_store
+    _text_cache = LruCache(max_entries) if max_entries and max_entries > 0 else None
+    _text_cache_store = store if _text_cache is not None else None
+
+
+def _model_identity(path: str) -> str:
+    try:
+        return f"{path}@{os.path.getmtime(os.path.join(path, 'config.json')):.0f}"
+    except OSError:
+        return path
+
+
+def _tox_identity(tox) -> str:
+    ident = _model_identity(TOXIC_MODEL_PATH)
+    if isinstance(tox, _OnnxTextClassifier):
+        ident += "#onnx-int8" if _onnx_quantize() else "#onnx"
+    return ident
+
+
+def text_moderation_identity() -> str:
+    """Идентичность текстовой модерации по настройкам (без загрузки моделей): модель, бэкенд, порог, zero-shot."""
+    # Без каталога: у воркеров на разных машинах путь к модели может отличаться
+    tox = os.path.basename(_model_identity(TOXIC_MODEL_PATH))
+    if _tox_backend() == "onnx":
+        tox += "#onnx-int8" if _onnx_quantize() else "#onnx"
+    zs = f"{ZERO_SHOT_MODEL}:{','.join(_zs_labels())}" if _zs_enabled() else "rules"
+    return f"{tox}|{_threshold():g}|{zs}"
+
+
+def _cache_key(text_norm: str, threshold: float, tox, zs, labels: List[str]) -> str:
+    ident = {
+        "text": text_norm,
+        "threshold": threshold,
+        "tox": _tox_identity(tox) if tox is not None else "rules",
+        "zs": ZERO_SHOT_MODEL if zs is not None else "rules",
+        "labels": list(labels) if zs is not None else [],
+    }
+    raw = json.dumps(ident, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str) -> Optional[List[dict]]:
+    if _text_cache is None:
+        return None
+    hit = _text_cache.get(key)
+    if hit is None and _text_cache_store is not None:
+        try:
+            hit = _text_cache_store.get(key)
+        except Exception as e:
+            logging.getLogger(__name__).warning("[CACHE][TEXT][ERROR] get failed: %s", e)
+            hit = None
+        if hit is not None:
+            _text_cache.put(key, hit)
+    return [dict(d) for d in hit] if hit is not None else None
+
+
+def _cache_put(key: str, detections: List[dict]) -> None:
+    if _text_cache is None:
+        return
+    _text_cache.put(key, [dict(d) for d in detections])
+    if _text_cache_store is not None:
+        try:
+            _text_cache_store.put(key, detections)
+        except Exception as e:
+            logging.getLogger(__name__).warning("[CACHE][TEXT][ERROR] put failed: %s", e)
+
+
+def _zs_labels() -> List[str]:
+    zs_labels_env = os.environ.get("TEXT_ZS_LABELS")
+    return [s.strip() for s in zs_labels_env.split(",") if s.strip()] if zs_labels_env else ZS_LABELS
+
+
+# ---------- Функции модерации текста ----------
+# Размер пачки текстов на один вызов трансформера
+BATCH_SIZE = 16
+
 
+def _normalize(text: str) -> str:
     # Небольшая предобработка
-    text_norm = " ".join((text or "").split())
-    if not text_norm:
-        return []
+    return " ".join((text or "").split())
+
 
+def _threshold() -> float:
     threshold_str = os.environ.get("TEXT_THRESHOLD")
     try:
-        threshold = float(threshold_str) if threshold_str else THRESHOLD
+        return float(threshold_str) if threshold_str else THRESHOLD
     except Exception:
-        threshold = THRESHOLD
+        return THRESHOLD
 
-    # -------- Токсичность (локальная модель, если доступна) --------
-    tox = _get_tox_classifier()
-    if tox is not None:
+
+def _token_length(tox, text: str) -> int:
+    tokenizer = getattr(tox, "tokenizer", None) if tox is not None else None
+    if tokenizer is not None:
         try:
-            tox_results = tox(text_norm)
-            if isinstance(tox_results, list) and tox_results:
-                for r in tox_results[0]:  # tox_results возвращает список списков
-                    label = str(r.get('label', '')).lower()
-                    score = float(r.get('score', 0.0))
-                    if label and label != "not_toxic" and score > threshold:
-                        detections.append({
-                            "type": "text",
-                            "category": "trash_talk",
-                            "score": score,
-                            "value": text_norm,
-                        })
+            return len(tokenizer(text, truncation=True)["input_ids"])
         except Exception:
             pass
-    else:
-        # Фолбэк-правила для токсичности
-        toxic_keywords = [
-            "идиот", "дурак", "тупой", "сволочь", "ублюд", "сука", "бляд", "лох",
-        ]
-        if any(k in text_norm.lower() for k in toxic_keywords):
+    return len(text)
+
+
+def _tox_detections(results, text_norm: str, threshold: float) -> List[dict]:
+    detections: List[dict] = []
+    # results — список оценок по всем меткам для одного текста
+    for r in results or []:
+        label = str(r.get('label', '')).lower()
+        score = float(r.get('score', 0.0))
+        if label and label != "not_toxic" and score > threshold:
             detections.append({
                 "type": "text",
                 "category": "trash_talk",
+                "score": score,
+                "value": text_norm,
+            })
+    return detections
+
+
+def _tox_rules(text_norm: str) -> List[dict]:
+    # Фолбэк-правила для токсичности
+    toxic_keywords = [
+        "идиот", "дурак", "тупой", "сволочь", "ублюд", "сука", "бляд", "лох",
+    ]
+    if any(k in text_norm.lower() for k in toxic_keywords):
+        return [{
+            "type": "text",
+            "category": "trash_talk",
+            "score": 1.0,
+            "value": text_norm,
+        }]
+    return []
+
+
+def _zs_detections(zs_result, text_norm: str, threshold: float) -> List[dict]:
+    detections: List[dict] = []
+    labels_out = zs_result.get("labels", [])
+    scores_out = zs_result.get("scores", [])
+    for label, score in zip(labels_out, scores_out):
+        if label != "acceptable" and float(score) > threshold:
+            detections.append({
+                "type": "text",
+                "category": label,
+                "score": float(score),
+                "value": text_norm,
+            })
+    return detections
+
+
+def _zs_rules(text_norm: str) -> List[dict]:
+    # Фолбэк-правила по ключевым словам
+    detections: List[dict] = []
+    lowered = text_norm.lower()
+    rules = [
+        ("politics", ["путин", "выборы", "митинг", "депутат", "рада", "кремль", "полит"]),
+        ("crypto", ["биткоин", "bitcoin", "крипто", "ethereum", "эфир", "bnb", "usdt"]),
+    ]
+    for category, keywords in rules:
+        if any(k in lowered for k in keywords):
+            detections.append({
+                "type": "text",
+                "category": category,
                 "score": 1.0,
                 "value": text_norm,
             })
+    return detections
 
-    # -------- Тематическая классификация (zero-shot, если включена и доступна) --------
-    zs = _get_zs_classifier()
-    if zs is not None:
+
+def _run_batched(run_batch, run_one, texts: List[str]):
+    """Прогоняет пачку через модель; при ошибке пачки — по одному тексту.
+
+    Возвращает (результаты, флаги ошибок) в порядке texts; результат текста
+    с ошибкой — None.
+    """
+    try:
+        results = list(run_batch(texts))
+        if len(results) == len(texts):
+            return results, [False] * len(texts)
+    except Exception:
+        pass
+    results, failed = [], []
+    for t in texts:
         try:
-            zs_labels_env = os.environ.get("TEXT_ZS_LABELS")
-            labels = [s.strip() for s in zs_labels_env.split(",") if s.strip()] if zs_labels_env else ZS_LABELS
-            zs_result = zs(text_norm, labels)
-            labels_out = zs_result.get("labels", [])
-            scores_out = zs_result.get("scores", [])
-            for label, score in zip(labels_out, scores_out):
-                if label != "acceptable" and float(score) > threshold:
-                    detections.append({
-                        "type": "text",
-                        "category": label,
-                        "score": float(score),
-                        "value": text_norm,
-                    })
+            results.append(run_one(t))
+            failed.append(False)
         except Exception:
-            pass
-    else:
-        # Фолбэк-правила по ключевым словам
-        lowered = text_norm.lower()
-        rules = [
-            ("politics", ["путин", "выборы", "митинг", "депутат", "рада", "кремль", "полит"]),
-            ("crypto", ["биткоин", "bitcoin", "крипто", "ethereum", "эфир", "bnb", "usdt"]),
-        ]
-        for category, keywords in rules:
-            if any(k in lowered for k in keywords):
-                detections.append({
-                    "type": "text",
-                    "category": category,
-                    "score": 1.0,
-                    "value": text_norm,
-                })
+            results.append(None)
+            failed.append(True)
+    return results, failed
 
-    return detections
+
+def moderate_texts_ai(texts: List[str], batch_size: int = BATCH_SIZE) -> List[List[dict]]:
+    """Пакетная модерация текстов.
+
+    Тексты нормализуются, повторы и попадания в кэш в модель не идут,
+    остальные сортируются по длине в токенах (меньше паддинга в пачке)
+    и прогоняются через пайплайны пачками по batch_size.
+    Возвращает список детекций для каждого входного текста в исходном порядке
+    (формат детекции — как у moderate_text_ai).
+    """
+    norms = [_normalize(t) for t in texts]
+    out: List[Optional[List[dict]]] = [None] * len(texts)
+
+    threshold = _threshold()
+    tox = _get_tox_classifier()
+    zs = _get_zs_classifier()
+    labels = _zs_labels()
+    batch_size = max(1, int(batch_size or 1))
+
+    # Кэш и дедупликация одинаковых описаний внутри пачки
+    keys: dict = {}
+    for i, text_norm in enumerate(norms):
+        if not text_norm:
+            out[i] = []
+            continue
+        key = _cache_key(text_norm, threshold, tox, zs, labels)
+        cached = _cache_get(key)
+        if cached is not None:
+            out[i] = cached
+            continue
+        keys.setdefault(key, (text_norm, []))[1].append(i)
+
+    if keys:
+        pending = sorted(keys.items(), key=lambda kv: _token_length(tox, kv[1][0]))
+        pending_texts = [text_norm for _, (text_norm, _) in pending]
+        computed: List[List[dict]] = [[] for _ in pending]
+        # Результат с ошибкой модели в кэш не кладём
+        failed = [False] * len(pending)
+
+        # -------- Токсичность (локальная модель, если доступна) --------
+        if tox is not None:
+            results, errs = _run_batched(
+                lambda ts: tox(ts, batch_size=batch_size, truncation=True),
+                lambda t: tox(t, truncation=True)[0],
+                pending_texts,
+            )
+            for j, (res, err) in enumerate(zip(results, errs)):
+                failed[j] = failed[j] or err
+                if not err:
+                    computed[j].extend(_tox_detections(res, pending_texts[j], threshold))
+        else:
+            for j, text_norm in enumerate(pending_texts):
+                computed[j].extend(_tox_rules(text_norm))
+
+        # -------- Тематическая классификация (zero-shot, если включена и доступна) --------
+        if zs is not None:
+            results, errs = _run_batched(
+                lambda ts: zs(ts, labels, batch_size=batch_size),
+                lambda t: zs(t, labels),
+                pending_texts,
+            )
+            for j, (res, err) in enumerate(zip(results, errs)):
+                failed[j] = failed[j] or err
+                if not err:
+                    computed[j].extend(_zs_detections(res, pending_texts[j], threshold))
+        else:
+            for j, text_norm in enumerate(pending_texts):
+                computed[j].extend(_zs_rules(text_norm))
+
+        for j, (key, (_, indices)) in enumerate(pending):
+            if not failed[j]:
+                _cache_put(key, computed[j])
+            for n, i in enumerate(indices):
+                out[i] = computed[j] if n == 0 else [dict(d) for d in computed[j]]
+
+    return [dets or [] for dets in out]
+
+
+def moderate_text_ai(text: str) -> List[dict]:
+    """
+    Возвращает список детекций для текста:
+    - type: "text"
+    - category: trash_talk | politics | crypto
+    - score: вероятность
+    - value: исходный текст / токен
+    """
+    return moderate_texts_ai([text])[0]
+
+
+def moderate_texts(texts: List[str], batch_size: int = BATCH_SIZE) -> List[List[dict]]:
+    """Пакетная версия moderate_text для всей выборки объявлений.
+
+    Возвращает детекции для каждого текста в исходном порядке; при ошибке
+    NLP-пайплайнов — пустые списки, чтобы не ронять модерацию.
+    """
+    texts = list(texts)
+    try:
+        with TEXT_MODEL_SECONDS.time():
+            return moderate_texts_ai(texts, batch_size=batch_size)
+    except Exception:
+        # Фэйл-сейф: на любых ошибках возвращаем пустые списки
+        return [[] for _ in texts]
 
 
 def moderate_text(text: str) -> List[dict]:
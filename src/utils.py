@@ -1,38 +1,219 @@
 from __future__ import annotations
 
 import os
+import threading
 import time
-from typing import Iterable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from .metrics import DOWNLOAD_BYTES, DOWNLOAD_ERRORS, DOWNLOAD_SECONDS
+
+# ---------- Общий HTTP-клиент загрузок ----------
+# Сессия, пул потоков и лимиты живут всё время работы процесса,
+# поэтому соединения переиспользуются между объявлениями.
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_PER_HOST_LIMIT = 4
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+_max_workers = DEFAULT_MAX_WORKERS
+_per_host_limit = DEFAULT_PER_HOST_LIMIT
+
+
+def configure_downloads(max_workers: int = DEFAULT_MAX_WORKERS, per_host_limit: int = DEFAULT_PER_HOST_LIMIT) -> None:
+    """Задаёт общий лимит параллельных загрузок и лимит соединений на один хост.
+
+    Повторный вызов с теми же значениями ничего не делает; при смене лимитов
+    пул потоков и сессия пересоздаются.
+    """
+    global _session, _executor, _max_workers, _per_host_limit
+    max_workers = max(1, int(max_workers))
+    per_host_limit = max(1, int(per_host_limit))
+    with _lock:
+        if max_workers == _max_workers and per_host_limit == _per_host_limit:
+            return
+        old_session, old_executor = _session, _executor
+        _max_workers = max_workers
+        _per_host_limit = per_host_limit
+        _session = None
+        _executor = None
+        _host_slots.clear()
+    if old_executor is not None:
+        old_executor.shutdown(wait=True)
+    if old_session is not None:
+        old_session.close()
 
-def download_files(urls: Iterable[str], target_dir: str, retries: int = 2, timeout: int = 15) -> List[str]:
-    os.makedirs(target_dir, exist_ok=True)
-    local_paths: List[str] = []
-    session = requests.Session()
-    for url in urls:
-        filename = os.path.basename(url.split("?")[0]) or "file"
-        local_path = os.path.join(target_dir, filename)
 
-        attempt = 0
-        while True:
-            try:
+def _get_session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            # pool_maxsize — число keep-alive соединений на один хост
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=_per_host_limit)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_max_workers, thread_name_prefix="download")
+        return _executor
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = urlparse(url).netloc
+    with _lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(_per_host_limit)
+            _host_slots[host] = slot
+        return slot
+
+
+def _download_one(url: str, local_path: str, retries: int, timeout: int) -> Optional[str]:
+    session = _get_session()
+    slot = _host_slot(url)
+    attempt = 0
+    while True:
+        try:
+            with slot:
                 with session.get(url, stream=True, timeout=timeout) as resp:
                     resp.raise_for_status()
                     with open(local_path, "wb") as f:
                         for chunk in resp.iter_content(chunk_size=8192):
                             if chunk:
                                 f.write(chunk)
-                local_paths.append(local_path)
-                break
-            except Exception:
-                attempt += 1
-                if attempt > retries:
-                    # пропускаем нескачанные файлы
-                    break
-                time.sleep(1.0 * attempt)
+            return local_path
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                # пропускаем нескачанные файлы
+                return None
+            # Пауза вне семафора, чтобы не держать слот хоста
+            time.sleep(1.0 * attempt)
+
+
+def download_files(urls: Iterable[str], target_dir: str, retries: int = 2, timeout: int = 15) -> List[str]:
+    """Параллельно скачивает urls в target_dir.
+
+    Возвращает локальные пути скачанных файлов в порядке исходных urls;
+    файлы, которые не удалось скачать, пропускаются.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    urls = list(urls)
+    if not urls:
+        return []
+
+    executor = _get_executor()
+    futures = []
+    for url in urls:
+        filename = os.path.basename(url.split("?")[0]) or "file"
+        local_path = os.path.join(target_dir, filename)
+        futures.append(executor.submit(_download_one, url, local_path, retries, timeout))
+
+    local_paths: List[str] = []
+    for fut in futures:
+        path = fut.result()
+        if path:
+            local_paths.append(path)
     return local_paths
 
 
-__all__ = ["download_files"]
+class _MemoryBudget:
+    """Счётчик байтов, которые одна загрузка держит в памяти."""
+
+    def __init__(self, limit: int):
+        self.limit = int(limit or 0)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def try_take(self, size: int) -> bool:
+        if self.limit <= 0:
+            return True
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+
+def _fetch_one(
+    url: str,
+    spill_path: str,
+    budget: _MemoryBudget,
+    retries: int,
+    timeout: int,
+) -> Optional[Union[bytes, str]]:
+    session = _get_session()
+    slot = _host_slot(url)
+    host = urlparse(url).netloc
+    attempt = 0
+    while True:
+        try:
+            with slot:
+                started = time.perf_counter()
+                with session.get(url, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    data = resp.content
+                DOWNLOAD_SECONDS.labels(host=host).observe(time.perf_counter() - started)
+            DOWNLOAD_BYTES.labels(host=host).inc(len(data))
+            if budget.try_take(len(data)):
+                return data
+            # Лимит памяти исчерпан — сбрасываем файл на диск
+            os.makedirs(os.path.dirname(spill_path), exist_ok=True)
+            with open(spill_path, "wb") as f:
+                f.write(data)
+            return spill_path
+        except Exception:
+            attempt += 1
+            if attempt > retries:
+                DOWNLOAD_ERRORS.labels(host=host).inc()
+                return None
+            time.sleep(1.0 * attempt)
+
+
+def download_buffers(
+    urls: Iterable[str],
+    spill_dir: Optional[str] = None,
+    memory_limit_bytes: int = 0,
+    retries: int = 2,
+    timeout: int = 15,
+) -> List[Tuple[str, Union[bytes, str]]]:
+    """Параллельно скачивает urls в память.
+
+    Возвращает пары (url, данные) в порядке исходных urls; данные — это bytes,
+    либо путь к файлу в spill_dir, если суммарный объём превысил memory_limit_bytes
+    (0 — без ограничения). Нескачанные файлы пропускаются.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+
+    budget = _MemoryBudget(memory_limit_bytes if spill_dir else 0)
+    executor = _get_executor()
+    futures = []
+    for url in urls:
+        filename = os.path.basename(url.split("?")[0]) or "file"
+        spill_path = os.path.join(spill_dir or "", filename)
+        futures.append(executor.submit(_fetch_one, url, spill_path, budget, retries, timeout))
+
+    items: List[Tuple[str, Union[bytes, str]]] = []
+    for url, fut in zip(urls, futures):
+        data = fut.result()
+        if data is not None:
+            items.append((url, data))
+    return items
+
+
+__all__ = ["download_files", "download_buffers", "configure_downloads"]